@@ -0,0 +1,88 @@
+"""Rows per second of dish creation: single-item POSTs vs bulk endpoint.
+
+The single path runs DishCrud.create for every dish, with its own commit,
+refresh and cache clear. The bulk path sends the dishes in batches to
+POST .../dishes/bulk, one transaction and one cache clear per batch.
+Requests go through the app in process.
+
+    python -m benchmarks.bulk_create --dishes 1000 --batch 500
+
+The schema of BENCH_DATABASE_URL is dropped and created again; it
+defaults to a throwaway SQLite file. The cache is the in-memory backend;
+set BENCH_CACHE_URL to include the Redis round trips. DATABASE_URL and
+CACHE_URL of the app are ignored.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+# The schema is dropped and created again: the app's DATABASE_URL is
+# never used, so a benchmark can't wipe the database of the app
+os.environ["DATABASE_URL"] = os.environ.get(
+        "BENCH_DATABASE_URL", "sqlite+aiosqlite:///./benchmark.db",
+)
+os.environ["CACHE_URL"] = os.environ.get("BENCH_CACHE_URL", "")
+os.environ["CACHE_BACKEND"] = "redis" if os.environ["CACHE_URL"] else "memory"
+
+from httpx import AsyncClient  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+
+from benchmarks.menu_list import seed  # noqa: E402
+from menu_app.database import get_session  # noqa: E402
+from menu_app.main import app  # noqa: E402
+
+
+def dish(number: int) -> dict:
+    return {
+        "title": f"Dish {number}",
+        "description": "Dish description",
+        "price": 9.99,
+    }
+
+
+async def single(client: AsyncClient, url: str, dishes: int, batch: int):
+    for number in range(dishes):
+        response = await client.post(url, json=dish(number))
+        response.raise_for_status()
+
+
+async def bulk(client: AsyncClient, url: str, dishes: int, batch: int):
+    for start in range(0, dishes, batch):
+        response = await client.post(f"{url}/bulk", json=[
+            dish(number)
+            for number in range(start, min(start + batch, dishes))
+        ])
+        response.raise_for_status()
+
+
+async def main(args):
+    engine = create_async_engine(os.environ["DATABASE_URL"])
+
+    async def get_session_override():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = get_session_override
+    print(f"{'path':>8} {'dishes':>8} {'seconds':>10} {'rows/s':>10}")
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        for name, create in (("single", single), ("bulk", bulk)):
+            await seed(engine, 1, 1, 0)
+            url = "/api/v1/menus/1/submenus/1/dishes"
+            started = time.perf_counter()
+            await create(client, url, args.dishes, args.batch)
+            elapsed = time.perf_counter() - started
+            print(
+                f"{name:>8} {args.dishes:>8} {elapsed:>10.2f} "
+                f"{args.dishes / elapsed:>10.0f}"
+            )
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dishes", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
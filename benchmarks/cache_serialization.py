@@ -0,0 +1,92 @@
+"""Size and speed of cached values: pickled ORM rows vs JSON read schemas.
+
+Before, Cache.save pickled the SQLModel rows loaded by the CRUD classes,
+SQLAlchemy instance state included. Now it stores the read schemas as
+orjson behind a version tag.
+
+    python -m benchmarks.cache_serialization --menus 100 --dishes 50
+
+The schema of BENCH_DATABASE_URL is dropped and created again; it
+defaults to a throwaway SQLite file and DATABASE_URL is ignored. The
+cache is the in-memory backend, as in the other benchmarks; only
+encoding is timed.
+"""
+import argparse
+import asyncio
+import os
+import pickle
+import time
+
+# The schema is dropped and created again: the app's DATABASE_URL is
+# never used, so a benchmark can't wipe the database of the app
+os.environ["DATABASE_URL"] = os.environ.get(
+        "BENCH_DATABASE_URL", "sqlite+aiosqlite:///./benchmark.db",
+)
+os.environ["CACHE_BACKEND"] = "memory"
+
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+from sqlmodel import select  # noqa: E402
+
+from benchmarks.menu_list import seed  # noqa: E402
+from menu_app.cache import Cache  # noqa: E402
+from menu_app.models.dish_model import Dish  # noqa: E402
+from menu_app.models.dish_model import DishRead  # noqa: E402
+from menu_app.models.menu_model import Menu  # noqa: E402
+from menu_app.models.menu_model import MenuRead  # noqa: E402
+
+
+def timed(function, value, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function(value)
+
+    return (time.perf_counter() - started) / repeat * 1_000_000
+
+
+def compare(name: str, rows, read_model, repeat: int):
+    if isinstance(rows, list):
+        read = [read_model.from_orm(row) for row in rows]
+    else:
+        read = read_model.from_orm(rows)
+    pickled = pickle.dumps(rows)
+    encoded = Cache.encode(read)
+
+    for format, value, data, encode, decode in (
+            ("pickle", rows, pickled, pickle.dumps, pickle.loads),
+            ("json", read, encoded, Cache.encode, Cache.decode),
+    ):
+        print(
+            f"{name:<14} {format:<8} {len(data):>10} "
+            f"{timed(encode, value, repeat):>12.1f} "
+            f"{timed(decode, data, repeat):>12.1f}"
+        )
+
+
+async def main(args):
+    engine = create_async_engine(os.environ["DATABASE_URL"])
+    await seed(engine, args.menus, 1, args.dishes)
+
+    async with AsyncSession(engine, expire_on_commit=False) as db:
+        menu = await db.get(Menu, 1)
+        menus = (await db.execute(select(Menu))).scalars().all()
+        dishes = (await db.execute(
+                select(Dish).where(Dish.submenu_id == 1)
+        )).scalars().all()
+    await engine.dispose()
+
+    print(
+        f"{'value':<14} {'format':<8} {'bytes':>10} "
+        f"{'encode, us':>12} {'decode, us':>12}"
+    )
+    compare("menu", menu, MenuRead, args.repeat)
+    compare("menu list", menus, MenuRead, args.repeat)
+    compare("dish list", dishes, DishRead, args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--menus", type=int, default=100)
+    parser.add_argument("--dishes", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
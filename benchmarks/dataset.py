@@ -0,0 +1,192 @@
+"""Large synthetic menus with skewed hierarchies for scale tests.
+
+Generates --menus menus, --submenus submenus and --dishes dishes in an
+emptied schema. Sizes follow a Zipf law with exponent --skew: a few
+submenus hold a large share of the dishes and most hold a handful, and
+the same goes for the submenus of menus (--skew 0 spreads them evenly).
+Which menu or submenu gets which size, titles, descriptions and prices
+all come from --seed, so a seed always gives the same rows.
+
+Rows are written with their ids and counters, parents first, in chunks
+of --chunk rows through menu_app.transfer.write: COPY on asyncpg and one
+executemany per chunk elsewhere. Dishes are generated chunk by chunk,
+so memory stays flat whatever their number.
+
+    python -m benchmarks.dataset --menus 10000 --submenus 100000 \\
+        --dishes 5000000 --seed 1
+
+The schema of BENCH_DATABASE_URL is dropped and created again; it
+defaults to a throwaway SQLite file and DATABASE_URL is ignored.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+# The schema is dropped and created again: the app's DATABASE_URL is
+# never used, so a benchmark can't wipe the database of the app
+os.environ["DATABASE_URL"] = os.environ.get(
+        "BENCH_DATABASE_URL", "sqlite+aiosqlite:///./benchmark.db",
+)
+os.environ.setdefault("CACHE_BACKEND", "null")
+
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+from sqlmodel import SQLModel  # noqa: E402
+
+from menu_app import transfer  # noqa: E402
+from menu_app.models.dish_model import Dish  # noqa: E402
+from menu_app.models.menu_model import Menu  # noqa: E402
+from menu_app.models.submenu_model import Submenu  # noqa: E402
+
+WORDS = (
+    "grilled", "smoked", "roasted", "fresh", "spicy", "sweet", "crispy",
+    "braised", "seasonal", "house", "garden", "wild", "salmon", "chicken",
+    "beef", "tofu", "mushroom", "rice", "noodles", "salad", "soup", "cake",
+    "cheese", "herbs", "lemon", "garlic", "chili", "honey", "truffle",
+)
+
+
+def sizes(total: int, buckets: int, skew: float, rng: random.Random) -> list:
+
+    # Zipf weights shuffled over the buckets, and the total split by them
+    # with largest remainders, so the sizes always add up to the total
+    if not buckets:
+        return []
+    weights = [1 / rank ** skew for rank in range(1, buckets + 1)]
+    rng.shuffle(weights)
+    scale = total / sum(weights)
+    shares = [weight * scale for weight in weights]
+    result = [int(share) for share in shares]
+    rest = sorted(
+            range(buckets),
+            key=lambda bucket: result[bucket] - shares[bucket],
+    )
+    for bucket in rest[:total - sum(result)]:
+        result[bucket] += 1
+
+    return result
+
+
+def text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+async def generate(
+        db: AsyncSession,
+        menus: int,
+        submenus: int,
+        dishes: int,
+        skew: float = 1.0,
+        seed: int = 0,
+        chunk: int = 10000,
+) -> dict:
+    rng = random.Random(seed)
+    per_menu = sizes(submenus, menus, skew, rng)
+    per_submenu = sizes(dishes, submenus, skew, rng)
+
+    # Submenus of a menu have consecutive ids, so do dishes of a submenu
+    menu_of = [
+        menu_id
+        for menu_id, count in enumerate(per_menu, start=1)
+        for _ in range(count)
+    ]
+    menu_dishes = [0] * menus
+    for submenu_id, count in enumerate(per_submenu, start=1):
+        menu_dishes[menu_of[submenu_id - 1] - 1] += count
+
+    rows = [
+        {
+            "id": menu_id,
+            "title": f"Menu {menu_id}",
+            "description": text(rng, 6),
+            "submenus_count": per_menu[menu_id - 1],
+            "dishes_count": menu_dishes[menu_id - 1],
+        }
+        for menu_id in range(1, menus + 1)
+    ]
+    for start in range(0, len(rows), chunk):
+        await transfer.write(db, Menu, rows[start:start + chunk])
+
+    rows = [
+        {
+            "id": submenu_id,
+            "menu_id": menu_of[submenu_id - 1],
+            "title": f"Submenu {submenu_id}",
+            "description": text(rng, 4),
+            "dishes_count": per_submenu[submenu_id - 1],
+        }
+        for submenu_id in range(1, submenus + 1)
+    ]
+    for start in range(0, len(rows), chunk):
+        await transfer.write(db, Submenu, rows[start:start + chunk])
+
+    rows = list()
+    dish_id = 0
+    for submenu_id, count in enumerate(per_submenu, start=1):
+        for _ in range(count):
+            dish_id += 1
+            rows.append({
+                "id": dish_id,
+                "submenu_id": submenu_id,
+                "title": f"{text(rng, 2)} {dish_id}",
+                "description": text(rng, 8),
+                "price": rng.randrange(100, 10000) / 100,
+            })
+            if len(rows) >= chunk:
+                await transfer.write(db, Dish, rows)
+    await transfer.write(db, Dish, rows)
+
+    await transfer.sequences(db)
+    await db.commit()
+
+    return {"submenus": per_menu, "dishes": per_submenu}
+
+
+def describe(name: str, counts: list):
+    if not counts:
+        return
+
+    # How much of the children the largest 1% of parents hold
+    largest = sorted(counts, reverse=True)
+    top = largest[:max(1, len(largest) // 100)]
+    print(
+        f"{name:<18} max {largest[0]:>9}  median "
+        f"{statistics.median(largest):>9.0f}  empty "
+        f"{largest.count(0):>7}  top 1% hold "
+        f"{sum(top) / max(sum(largest), 1):>6.1%}"
+    )
+
+
+async def main(args):
+    engine = create_async_engine(os.environ["DATABASE_URL"])
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+    started = time.perf_counter()
+    async with AsyncSession(engine, expire_on_commit=False) as db:
+        counts = await generate(
+                db, args.menus, args.submenus, args.dishes,
+                args.skew, args.seed, args.chunk,
+        )
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+
+    rows = args.menus + args.submenus + args.dishes
+    print(f"{rows} rows in {elapsed:.1f} s, {rows / elapsed:.0f} rows/s")
+    describe("submenus per menu", counts["submenus"])
+    describe("dishes per submenu", counts["dishes"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--menus", type=int, default=10000)
+    parser.add_argument("--submenus", type=int, default=100000)
+    parser.add_argument("--dishes", type=int, default=5000000)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk", type=int, default=10000)
+    asyncio.run(main(parser.parse_args()))
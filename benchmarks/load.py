@@ -0,0 +1,437 @@
+"""Throughput and latency percentiles of every route under load.
+
+Seeds menus, submenus and dishes, then drives each route of
+menu_app.main in turn with a fixed number of concurrent clients, for
+every concurrency level. Reports requests per second, p50/p95/p99
+latency, errors and the cache hits and misses of each route. The cache
+is flushed before each route, so the split depends on the dataset and
+the number of requests only. Requests go through the app in process;
+POST /api/v1/cache/warm is left out, its background warm-up would load
+the cache under the routes measured after it.
+
+    python -m benchmarks.load --concurrency 1 8 32 --output load.json
+    python -m benchmarks.load --baseline load.json
+
+Results are written as JSON with --output. With --baseline, every route
+is compared with the stored run and the exit status is 1 when its p95
+grew or its throughput fell by more than --tolerance.
+
+The schema of BENCH_DATABASE_URL is dropped and created again, and
+the Redis of BENCH_CACHE_URL is flushed before each route. They default
+to a throwaway SQLite file and the in-memory backend; DATABASE_URL and
+CACHE_URL of the app are ignored.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+# The schema is dropped and created again: the app's DATABASE_URL is
+# never used, so a benchmark can't wipe the database of the app
+os.environ["DATABASE_URL"] = os.environ.get(
+        "BENCH_DATABASE_URL", "sqlite+aiosqlite:///./benchmark.db",
+)
+os.environ["CACHE_URL"] = os.environ.get("BENCH_CACHE_URL", "")
+os.environ["CACHE_BACKEND"] = "redis" if os.environ["CACHE_URL"] else "memory"
+
+from httpx import AsyncClient  # noqa: E402
+
+from benchmarks.menu_list import seed  # noqa: E402
+from menu_app import metrics  # noqa: E402
+from menu_app import transfer  # noqa: E402
+from menu_app.cache import Cache  # noqa: E402
+from menu_app.database import async_engine  # noqa: E402
+from menu_app.database import async_session  # noqa: E402
+from menu_app.main import app  # noqa: E402
+
+API = "/api/v1"
+IMPORTED_IDS = 10 ** 9
+
+
+class Dataset():
+
+    # Ids of the seeded rows, as laid out by benchmarks.menu_list.seed,
+    # and of the rows created during the run, to be deleted at its end
+
+    def __init__(self, menus: int, submenus: int, dishes: int):
+        self.menus = menus
+        self.submenus = submenus
+        self.dishes = dishes
+        self.created = {"menu": [], "submenu": [], "dish": []}
+
+    def menu(self, i: int) -> int:
+        return i % self.menus + 1
+
+    def submenu(self, i: int) -> tuple:
+        menu_id = self.menu(i)
+        return menu_id, (menu_id - 1) * self.submenus + i % self.submenus + 1
+
+    def dish(self, i: int) -> tuple:
+        menu_id, submenu_id = self.submenu(i)
+        dish_id = (submenu_id - 1) * self.dishes + i % self.dishes + 1
+        return menu_id, submenu_id, dish_id
+
+
+def item(kind: str, i: int) -> dict:
+    data = {"title": f"Load {kind} {i}", "description": f"Load {kind}"}
+    if kind == "dish":
+        data["price"] = "9.99"
+    return data
+
+
+def scenarios(data: Dataset) -> list:
+
+    # (route, request of the i-th call as (method, url, options)),
+    # reads first and deletes last, so every route finds its rows
+    def menu_url(i):
+        return f"{API}/menus/{data.menu(i)}"
+
+    def submenu_url(i):
+        return "{}/menus/{}/submenus/{}".format(API, *data.submenu(i))
+
+    def dish_url(i):
+        return "{}/menus/{}/submenus/{}/dishes/{}".format(API, *data.dish(i))
+
+    def created(kind, i):
+        ids = data.created[kind]
+        return ids[i % len(ids)] if ids else (0, 0, 0)
+
+    def record(i):
+        return json.dumps({
+            "type": "menu", "id": IMPORTED_IDS + i, **item("menu", i),
+        }).encode()
+
+    routes = [
+        ("GET /", lambda i: ("GET", "/", {})),
+        ("GET /metrics", lambda i: ("GET", "/metrics", {})),
+        ("GET /api/v1/ready", lambda i: ("GET", f"{API}/ready", {})),
+        ("GET /api/v1/db/pool", lambda i: ("GET", f"{API}/db/pool", {})),
+        (
+            "GET /api/v1/cache/stats",
+            lambda i: ("GET", f"{API}/cache/stats", {}),
+        ),
+        ("GET /api/v1/menus", lambda i: ("GET", f"{API}/menus", {})),
+        (
+            "GET /api/v1/menus?limit",
+            lambda i: ("GET", f"{API}/menus", {"params": {"limit": 10}}),
+        ),
+        ("GET /api/v1/menus/tree", lambda i: ("GET", f"{API}/menus/tree", {})),
+        (
+            "GET /api/v1/menus/{menu_id}/tree",
+            lambda i: ("GET", f"{menu_url(i)}/tree", {}),
+        ),
+        ("GET /api/v1/menus/{menu_id}", lambda i: ("GET", menu_url(i), {})),
+        (
+            "GET /api/v1/menus/{menu_id}/submenus",
+            lambda i: ("GET", f"{menu_url(i)}/submenus", {}),
+        ),
+    ]
+    if data.submenus:
+        routes += [
+            (
+                "GET /api/v1/menus/{menu_id}/submenus/{submenu_id}",
+                lambda i: ("GET", submenu_url(i), {}),
+            ),
+            (
+                "GET /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes",
+                lambda i: ("GET", f"{submenu_url(i)}/dishes", {}),
+            ),
+        ]
+    if data.submenus and data.dishes:
+        routes.append((
+            "GET /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/"
+            "{dish_id}",
+            lambda i: ("GET", dish_url(i), {}),
+        ))
+
+    routes += [
+        (
+            "GET /api/v1/export",
+            lambda i: ("GET", f"{API}/export", {}),
+        ),
+        (
+            "POST /api/v1/import",
+            lambda i: ("POST", f"{API}/import", {"content": record(i)}),
+        ),
+        (
+            "POST /api/v1/menus",
+            lambda i: ("POST", f"{API}/menus", {"json": item("menu", i)}),
+        ),
+        (
+            "PATCH /api/v1/menus/{menu_id}",
+            lambda i: ("PATCH", menu_url(i), {"json": item("menu", i)}),
+        ),
+        (
+            "POST /api/v1/menus/{menu_id}/submenus",
+            lambda i: (
+                "POST", f"{menu_url(i)}/submenus",
+                {"json": item("submenu", i)},
+            ),
+        ),
+        (
+            "POST /api/v1/menus/{menu_id}/submenus/bulk",
+            lambda i: (
+                "POST", f"{menu_url(i)}/submenus/bulk",
+                {"json": [item("submenu", i)] * 10},
+            ),
+        ),
+    ]
+    if data.submenus:
+        routes += [
+            (
+                "PATCH /api/v1/menus/{menu_id}/submenus/{submenu_id}",
+                lambda i: (
+                    "PATCH", submenu_url(i), {"json": item("submenu", i)},
+                ),
+            ),
+            (
+                "POST /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes",
+                lambda i: (
+                    "POST", f"{submenu_url(i)}/dishes",
+                    {"json": item("dish", i)},
+                ),
+            ),
+            (
+                "POST /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/"
+                "bulk",
+                lambda i: (
+                    "POST", f"{submenu_url(i)}/dishes/bulk",
+                    {"json": [item("dish", i)] * 10},
+                ),
+            ),
+        ]
+    if data.submenus and data.dishes:
+        routes.append((
+            "PATCH /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/"
+            "{dish_id}",
+            lambda i: ("PATCH", dish_url(i), {"json": item("dish", i)}),
+        ))
+
+    routes += [
+        (
+            "DELETE /api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/"
+            "{dish_id}",
+            lambda i: (
+                "DELETE",
+                "{}/menus/{}/submenus/{}/dishes/{}".format(
+                    API, *created("dish", i)
+                ),
+                {},
+            ),
+        ),
+        (
+            "DELETE /api/v1/menus/{menu_id}/submenus/{submenu_id}",
+            lambda i: (
+                "DELETE",
+                "{}/menus/{}/submenus/{}".format(
+                    API, *created("submenu", i)[:2]
+                ),
+                {},
+            ),
+        ),
+        (
+            "DELETE /api/v1/menus/{menu_id}",
+            lambda i: (
+                "DELETE", f"{API}/menus/{created('menu', i)[0]}", {},
+            ),
+        ),
+    ]
+
+    return routes
+
+
+def remember(data: Dataset, route: str, response):
+
+    # Rows created by single POSTs are the ones the DELETEs remove
+    if response.status_code != 201 or route.endswith("bulk"):
+        return
+    body = response.json()
+    if route == "POST /api/v1/menus":
+        data.created["menu"].append((body["id"],))
+    elif route.endswith("/submenus"):
+        data.created["submenu"].append(
+                (body["menu_id"], body["id"])
+        )
+    elif route.endswith("/dishes"):
+        menu_id, submenu_id = response.url.path.split("/")[4:7:2]
+        data.created["dish"].append(
+                (int(menu_id), int(submenu_id), body["id"])
+        )
+
+
+def cache_requests() -> dict:
+    totals = {"hit": 0.0, "miss": 0.0}
+    for family in metrics.CACHE_REQUESTS.collect():
+        for sample in family.samples:
+            result = sample.labels.get("result")
+            if sample.name.endswith("_total") and result in totals:
+                totals[result] += sample.value
+
+    return totals
+
+
+def percentile(timings: list, fraction: float) -> float:
+
+    # Nearest rank of sorted timings
+    index = max(0, round(fraction * len(timings) + 0.5) - 1)
+
+    return timings[min(index, len(timings) - 1)]
+
+
+async def run(
+        client: AsyncClient,
+        data: Dataset,
+        route: str,
+        request,
+        concurrency: int,
+        requests: int,
+) -> dict:
+    await Cache.clear()
+    before = cache_requests()
+    timings = list()
+    errors = 0
+
+    # Clients share one iterator of call numbers, as the warm-up does
+    calls = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in calls:
+            method, url, options = request(i)
+            started = time.perf_counter()
+            response = await client.request(method, url, **options)
+            timings.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            remember(data, route, response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    after = cache_requests()
+    timings.sort()
+
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "cache_hits": int(after["hit"] - before["hit"]),
+        "cache_misses": int(after["miss"] - before["miss"]),
+    }
+
+
+async def reset(args):
+
+    # Every concurrency level starts from the same dataset
+    await seed(async_engine, args.menus, args.submenus, args.dishes)
+    await Cache.clear()
+
+    # Rows were inserted with their ids, sequences have to catch up
+    async with async_session() as db:
+        await transfer.sequences(db)
+        await db.commit()
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+
+    # Runs of different datasets or backends can't be compared fairly
+    for name, value in baseline["config"].items():
+        if name != "concurrency" and report["config"].get(name) != value:
+            print(f"Baseline {name} is {value}, not {report['config'][name]}")
+
+    results = report["results"]
+    stored = {
+        (result["route"], result["concurrency"]): result
+        for result in baseline["results"]
+    }
+    regressions = list()
+    print(f"\n{'route':<72} {'c':>4} {'p95 change':>11} {'rps change':>11}")
+    for result in results:
+        before = stored.get((result["route"], result["concurrency"]))
+        if before is None:
+            continue
+        p95 = result["p95_ms"] / before["p95_ms"] - 1
+        rps = result["rps"] / before["rps"] - 1
+        flag = ""
+        if p95 > tolerance or rps < -tolerance:
+            regressions.append(result)
+            flag = "  REGRESSION"
+        print(
+            f"{result['route']:<72} {result['concurrency']:>4} "
+            f"{p95:>+10.1%} {rps:>+10.1%}{flag}"
+        )
+
+    return regressions
+
+
+async def main(args):
+    results = list()
+    print(
+        f"{'route':<72} {'c':>4} {'rps':>8} {'p50':>8} {'p95':>8} "
+        f"{'p99':>8} {'hits':>6} {'miss':>6} {'err':>5}"
+    )
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        for concurrency in args.concurrency:
+            await reset(args)
+            data = Dataset(args.menus, args.submenus, args.dishes)
+            for route, request in scenarios(data):
+                result = await run(
+                        client, data, route, request,
+                        concurrency, args.requests,
+                )
+                results.append(result)
+                print(
+                    f"{route:<72} {concurrency:>4} {result['rps']:>8.0f} "
+                    f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                    f"{result['p99_ms']:>8.2f} {result['cache_hits']:>6} "
+                    f"{result['cache_misses']:>6} {result['errors']:>5}"
+                )
+
+    await async_engine.dispose()
+
+    report = {
+        "config": {
+            "menus": args.menus,
+            "submenus": args.submenus,
+            "dishes": args.dishes,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "database": async_engine.dialect.name,
+            "cache": type(Cache.backend).__name__,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(
+                    report, json.load(baseline), args.tolerance
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--menus", type=int, default=20)
+    parser.add_argument("--submenus", type=int, default=5)
+    parser.add_argument("--dishes", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+            "--concurrency", type=int, nargs="+", default=[1, 8, 32]
+    )
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,154 @@
+"""Latency of the menu listing as the number of menus grows.
+
+Compares the per-menu counting used before (two COUNT queries for every
+menu), a single aggregate query over all menus, and reading the counters
+stored in the menu rows, which is what MenuCrud.get_list does now.
+The cache is not involved: every variant goes straight to the database.
+
+    python -m benchmarks.menu_list --sizes 10 100 1000 10000
+
+The schema of BENCH_DATABASE_URL is dropped and created again; it
+defaults to a throwaway SQLite file and DATABASE_URL is ignored.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+# The schema is dropped and created again: the app's DATABASE_URL is
+# never used, so a benchmark can't wipe the database of the app
+os.environ["DATABASE_URL"] = os.environ.get(
+        "BENCH_DATABASE_URL", "sqlite+aiosqlite:///./benchmark.db",
+)
+os.environ["CACHE_BACKEND"] = "null"
+
+from sqlalchemy import func  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+from sqlmodel import select  # noqa: E402
+from sqlmodel import SQLModel  # noqa: E402
+
+from menu_app.counters import menu_counts  # noqa: E402
+from menu_app.models.dish_model import Dish  # noqa: E402
+from menu_app.models.menu_model import Menu  # noqa: E402
+from menu_app.models.submenu_model import Submenu  # noqa: E402
+
+
+async def seed(engine, menus: int, submenus: int, dishes: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.execute(insert(Menu), [
+            {
+                "id": m,
+                "title": f"Menu {m}",
+                "description": "Menu",
+                "submenus_count": submenus,
+                "dishes_count": submenus * dishes,
+            }
+            for m in range(1, menus + 1)
+        ])
+        await conn.execute(insert(Submenu), [
+            {
+                "id": (m - 1) * submenus + s,
+                "menu_id": m,
+                "title": f"Submenu {s}",
+                "description": "Submenu",
+                "dishes_count": dishes,
+            }
+            for m in range(1, menus + 1)
+            for s in range(1, submenus + 1)
+        ])
+        if not dishes:
+            return
+        await conn.execute(insert(Dish), [
+            {
+                "submenu_id": s,
+                "title": f"Dish {d}",
+                "description": "Dish",
+                "price": 9.99,
+            }
+            for s in range(1, menus * submenus + 1)
+            for d in range(dishes)
+        ])
+
+
+async def per_menu(db: AsyncSession):
+    menus = await db.execute(select(Menu))
+    result_data = list()
+    for menu in menus.scalars().all():
+        submenus_count = await db.execute(
+                select(
+                    func.count(Submenu.id)
+                ).where(Submenu.menu_id == menu.id)
+        )
+        dishes_count = await db.execute(
+                select(
+                    func.count(Dish.id)
+                ).join(Submenu).where(Submenu.menu_id == menu.id)
+        )
+        result_data.append((
+                menu,
+                submenus_count.scalars().one(),
+                dishes_count.scalars().one(),
+        ))
+
+    return result_data
+
+
+async def aggregate(db: AsyncSession):
+    counts = menu_counts()
+    result = await db.execute(
+            select(
+                Menu, counts.c.submenus_count, counts.c.dishes_count
+            ).join(counts, counts.c.id == Menu.id).order_by(Menu.id)
+    )
+
+    return result.all()
+
+
+async def stored(db: AsyncSession):
+    result = await db.execute(select(Menu).order_by(Menu.id))
+
+    return result.scalars().all()
+
+
+async def measure(engine, listing, repeat: int) -> float:
+    timings = list()
+    for _ in range(repeat):
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            started = time.perf_counter()
+            await listing(db)
+            timings.append(time.perf_counter() - started)
+            await db.rollback()
+
+    return min(timings) * 1000
+
+
+async def main(args):
+    engine = create_async_engine(os.environ["DATABASE_URL"])
+    print(
+        f"{'menus':>8} {'per-menu, ms':>14} "
+        f"{'aggregate, ms':>14} {'stored, ms':>14}"
+    )
+    for size in args.sizes:
+        await seed(engine, size, args.submenus, args.dishes)
+        timings = [
+            await measure(engine, listing, args.repeat)
+            for listing in (per_menu, aggregate, stored)
+        ]
+        print(f"{size:>8}", *(f"{ms:>14.2f}" for ms in timings))
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000]
+    )
+    parser.add_argument("--submenus", type=int, default=3)
+    parser.add_argument("--dishes", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
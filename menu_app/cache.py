@@ -1,33 +1,518 @@
+import asyncio
+import hashlib
 import os
-import pickle
+import random
+import time
 import typing
+from collections import OrderedDict
 
-from aioredis import from_url
+import orjson
+from pydantic import BaseModel
+
+from menu_app import cache_backends
+from menu_app import metrics
+
+
+MISSING = object()
+
+
+class LocalCache():
+
+    # Bounded in-process LRU with a TTL for every entry
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.data = OrderedDict()
+
+    def get(self, key: str) -> typing.Any:
+        entry = self.data.get(key)
+        if entry is None:
+            return MISSING
+
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.data[key]
+            return MISSING
+
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: typing.Any):
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    def delete(self, *keys: str):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+
+class setting():
+
+    # Class attribute computed by the decorated function on first access
+    # and then stored in its place, so it can still be assigned
+    def __init__(self, function):
+        self.function = function
+
+    def __get__(self, instance, owner):
+        value = self.function(owner)
+        setattr(owner, self.function.__name__, value)
+
+        return value
 
 
 class Cache():
 
-    cache = from_url(
-            os.environ.get('CACHE_URL'),
-            encoding='latin-1',
-            decode_responses=False)
+    # Keys are paths like "menu:1/submenu:2/dish:3": every segment before
+    # the last one is a namespace with its own generation number, and
+    # every key has a version. Both are embedded in the stored key
+    # ("menu:1#0/submenu:2#4/dish:3#1"). Clearing a key increments its
+    # version and purging a namespace its generation, so old entries are
+    # never read again and age out with the TTL. Invalidation is thus
+    # a single round trip of INCRs, without reading anything first.
+    #
+    # With CACHE_L1_SIZE set, values and generations are also kept in
+    # a local LRU of each worker. Workers publish what they invalidate
+    # and `listen` drops the same entries from the LRU of every worker.
+
+    # Values, counters and locks live in the backend of CACHE_BACKEND,
+    # see menu_app.cache_backends. It is chosen on first use (the app's
+    # startup), so importing this module needs no cache settings.
+    @setting
+    def backend(cls) -> cache_backends.Backend:
+        return cache_backends.from_env()
+
+    # TTL in seconds per key prefix ("menu=600,dishes=60"), CACHE_TTL for
+    # the rest, stretched by up to CACHE_TTL_JITTER of itself so entries
+    # saved together don't expire together. With CACHE_STALE set, entries
+    # live that many seconds more and are served stale meanwhile, while
+    # they are reloaded in background.
+    ttl = int(os.environ.get('CACHE_TTL', 3600))
+    ttls = {
+        prefix.strip(): int(seconds)
+        for prefix, _, seconds in (
+            item.partition("=")
+            for item in os.environ.get('CACHE_TTLS', '').split(",")
+            if item.strip()
+        )
+    }
+    jitter = float(os.environ.get('CACHE_TTL_JITTER', 0.1))
+    stale = int(os.environ.get('CACHE_STALE', 0))
+
+    # Counters expire too, in milliseconds, at twice the longest life of
+    # an entry. Their TTL is refreshed whenever an entry is saved under
+    # them or they are bumped, so any entry saved under a counter is gone
+    # before the counter can expire and restart from zero.
+    counter_ttl = int(
+            2 * (max([ttl, *ttls.values()]) * (1 + jitter) + stale) * 1000
+    )
+    channel = "cache:invalidate"
+
+    @setting
+    def local(cls) -> LocalCache | None:
+        if (
+            isinstance(cls.backend, cache_backends.NullBackend)
+            or not int(os.environ.get('CACHE_L1_SIZE', 0))
+        ):
+            return None
+
+        return LocalCache(
+                int(os.environ.get('CACHE_L1_SIZE')),
+                float(os.environ.get('CACHE_L1_TTL', 5)),
+        )
+
+    hits = {"l1": 0, "l2": 0}
+    misses = {"l1": 0, "l2": 0}
+
+    # Stored keys being loaded by this worker, and how long other workers
+    # may hold the lock of a key they load before it is loaded here too
+    flights = dict()
+    lock_ttl = int(os.environ.get('CACHE_LOCK_TTL', 5000))
+    lock_poll = 0.02
+
+    # Values are stored as JSON of read schemas behind a version tag and
+    # the hash of the JSON, which is the ETag of the value. Bump the
+    # version when a read schema changes: entries written in the old
+    # shape then read as misses instead of failing validation.
+    version = b"v2:"
+    digest_size = 20
+
+    @staticmethod
+    def default(value: typing.Any):
+        if isinstance(value, BaseModel):
+            return value.dict()
+        raise TypeError
+
+    @staticmethod
+    def digest(body: bytes) -> bytes:
+        return hashlib.sha1(body).hexdigest()[:Cache.digest_size].encode()
 
     @classmethod
-    async def save(cls, key: str, value: typing.Any):
-        value = pickle.dumps(value)
-        await cls.cache.set(key, value)
+    def encode(cls, value: typing.Any) -> bytes:
+        body = orjson.dumps(value, default=cls.default)
+        return cls.version + cls.digest(body) + body
+
+    @classmethod
+    def unpack(cls, data: bytes | None) -> tuple:
+
+        # Body and its ETag, or Nones for entries of other versions
+        if not data or not data.startswith(cls.version):
+            return None, None
+        start = len(cls.version) + cls.digest_size
+        digest = data[len(cls.version):start]
+
+        return data[start:], f'"{digest.decode()}"'
+
+    @classmethod
+    def decode(cls, data: bytes) -> typing.Any:
+        body, _ = cls.unpack(data)
+        if body is None:
+            return None
+        return orjson.loads(body)
+
+    @staticmethod
+    def namespaces(key: str) -> list:
+        return key.split("/")[:-1]
+
+    @staticmethod
+    def version_key(key: str) -> str:
+
+        # Pages of a list ("menus?after=3&limit=10") share its version,
+        # so clearing the list makes all of its pages unreachable
+        return f"ver:{key.partition('?')[0]}"
+
+    @classmethod
+    def counter_keys(cls, key: str) -> list:
+        return [
+            *(f"gen:{namespace}" for namespace in cls.namespaces(key)),
+            cls.version_key(key),
+        ]
+
+    @classmethod
+    async def counters(cls, *keys: str) -> dict:
+
+        # Namespace generations and key versions, missing ones are zero
+        counters = dict()
+        if cls.local:
+            for key in keys:
+                counter = cls.local.get(key)
+                if counter is not MISSING:
+                    counters[key] = counter
+
+        missing = [key for key in keys if key not in counters]
+        if missing:
+            values = await cls.backend.get_many(*missing)
+            for key, counter in zip(missing, values):
+                counters[key] = int(counter or 0)
+                if cls.local:
+                    cls.local.set(key, counters[key])
+
+        return counters
+
+    @classmethod
+    async def resolve(cls, *keys: str) -> list:
+
+        # Stored keys, with counters of all keys read by one MGET
+        counters = await cls.counters(*sorted({
+            name for key in keys for name in cls.counter_keys(key)
+        }))
+
+        return [
+            "/".join([
+                *(
+                    f"{namespace}#{counters[f'gen:{namespace}']}"
+                    for namespace in cls.namespaces(key)
+                ),
+                key.split("/")[-1],
+            ]) + f"#{counters[cls.version_key(key)]}"
+            for key in keys
+        ]
+
+    @classmethod
+    def etag(cls, body: bytes) -> str:
+
+        # Strong ETag of the value, the hash of its bytes: a reload which
+        # saves other bytes under the same key changes it too
+        return f'"{cls.digest(body).decode()}"'
+
+    @classmethod
+    def expiry(cls, key: str) -> int:
+        ttl = cls.ttls.get(metrics.prefix(key), cls.ttl)
+        ttl *= 1 + random.uniform(0, cls.jitter)
+
+        return int((ttl + cls.stale) * 1000)
+
+    @classmethod
+    async def save_many(cls, values: dict, stored: dict = None) -> list:
+
+        # Values by key, saved in one round trip. Keys resolved before the
+        # values were read from the database can be passed in `stored`:
+        # if a write bumps a version meanwhile, the value is saved under
+        # the old one and is never read.
+        if not values:
+            return []
+
+        stored = dict(stored or {})
+        missing = [key for key in values if key not in stored]
+        stored.update(zip(missing, await cls.resolve(*missing)))
+
+        items = list()
+        bodies = list()
+        for key, value in values.items():
+            data = cls.encode(value)
+            items.append((stored[key], data, cls.expiry(key)))
+            body, etag = cls.unpack(data)
+            bodies.append(body)
+            if cls.local:
+                cls.local.set(stored[key], (body, etag))
+        touch = sorted({
+            name for key in values for name in cls.counter_keys(key)
+        })
+        with metrics.cache_operation(next(iter(values)), "save"):
+            await cls.backend.set_many(items, touch, cls.counter_ttl)
+
+        return bodies
+
+    @classmethod
+    async def save(
+            cls,
+            key: str,
+            value: typing.Any,
+            stored: str = None,
+    ) -> bytes:
+        body, = await cls.save_many(
+                {key: value}, {key: stored} if stored else None
+        )
+
+        return body
+
+    @classmethod
+    async def get_many(cls, *keys: str) -> list:
+
+        # Bodies of many keys, None for misses, with one MGET
+        stored = await cls.resolve(*keys)
+        bodies = dict()
+        if cls.local:
+            for key in stored:
+                entry = cls.local.get(key)
+                if entry is not MISSING:
+                    bodies[key], _ = entry
+
+        missing = [key for key in stored if key not in bodies]
+        if missing:
+            for key, data in zip(
+                    missing, await cls.backend.get_many(*missing)
+            ):
+                body, _ = cls.unpack(data)
+                if body is not None:
+                    bodies[key] = body
+
+        return [bodies.get(key) for key in stored]
+
+    @classmethod
+    async def get_raw(cls, key: str) -> bytes | None:
+
+        # JSON as it was saved, ready to be sent as a response body
+        body, _, _ = await cls.get_entry(key)
+
+        return body
+
+    @classmethod
+    async def get_entry(cls, key: str, stored: str = None) -> tuple:
+
+        # Body, its ETag and whether it is past its TTL and should be
+        # reloaded
+        with metrics.cache_operation(key, "get"):
+            if stored is None:
+                stored, = await cls.resolve(key)
+            body, etag, stale = await cls.lookup(stored)
+        metrics.CACHE_REQUESTS.labels(
+                metrics.prefix(key), "miss" if body is None else "hit"
+        ).inc()
+
+        return body, etag, stale
+
+    @classmethod
+    async def lookup(cls, stored: str, record: bool = True) -> tuple:
+
+        # Hits and misses of the tiers are counted once per request,
+        # polls of a request that already missed pass `record=False`
+        if cls.local:
+            entry = cls.local.get(stored)
+            if entry is not MISSING:
+                cls.hits["l1"] += record
+                return (*entry, False)
+            cls.misses["l1"] += record
+
+        data, expires = await cls.backend.get_with_ttl(stored)
+
+        body, etag = cls.unpack(data)
+        if body is not None:
+            cls.hits["l2"] += record
+            stale = 0 <= expires < cls.stale * 1000
+            if cls.local and not stale:
+                cls.local.set(stored, (body, etag))
+            return body, etag, stale
+        cls.misses["l2"] += record
+
+        return None, None, False
+
+    @classmethod
+    async def single_flight(
+            cls,
+            key: str,
+            load,
+            stored: str = None,
+    ) -> typing.Any:
+
+        # Concurrent misses of a key in this worker await the one load.
+        # Loads are told apart by the stored key: a request which resolved
+        # the key after a write must not get the body of a load which
+        # started before it, under the old version.
+        if stored is None:
+            stored, = await cls.resolve(key)
+        flight = cls.flights.get(stored)
+        if flight is not None:
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                return await cls.single_flight(key, load, stored)
+
+        flight = asyncio.get_running_loop().create_future()
+        cls.flights[stored] = flight
+        try:
+            result = await cls.coalesce(key, load, stored)
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as error:
+            flight.set_exception(error)
+
+            # Marks the exception retrieved when nobody waited for it
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del cls.flights[stored]
+
+    @classmethod
+    async def coalesce(
+            cls,
+            key: str,
+            load,
+            stored: str = None,
+    ) -> typing.Any:
+
+        # Across workers the key is loaded by the holder of a short lock,
+        # the others poll the cache until the value or the lock is gone
+        lock = f"lock:{key}"
+        token = os.urandom(8).hex()
+        if await cls.backend.set(lock, token, nx=True, px=cls.lock_ttl):
+            try:
+                return await load()
+            finally:
+                await cls.backend.unlock(lock, token)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + cls.lock_ttl / 1000
+        while loop.time() < deadline:
+            await asyncio.sleep(cls.lock_poll)
+            if stored is None:
+                stored, = await cls.resolve(key)
+            body, _, _ = await cls.lookup(stored, record=False)
+            if body is not None:
+                return body
+            if not await cls.backend.exists(lock):
+                break
+
+        return await load()
 
     @classmethod
     async def get_data(cls, key: str) -> typing.Any | None:
-        data = await cls.cache.get(key)
+        body = await cls.get_raw(key)
 
-        if data:
-            return pickle.loads(data)
+        if body is not None:
+            return orjson.loads(body)
+
+    @classmethod
+    async def invalidate_many(cls, keys=(), namespaces=()):
+
+        # Bumps versions of the keys and generations of the namespaces in
+        # one round trip, the publish to other workers included. Entries
+        # under the old counters are never read again and age out with
+        # their TTL.
+        #
+        # Counters are never deleted: starting one again from zero could
+        # bring back entries that are still alive. They expire only after
+        # all of those, see counter_ttl.
+        counters = [
+            *(cls.version_key(key) for key in keys),
+            *(f"gen:{namespace}" for namespace in namespaces),
+        ]
+        if not counters:
+            return
+
+        message = None
+        if cls.local:
+            cls.drop_local(*counters)
+            message = "\n".join(counters)
+        await cls.backend.incr(
+                *counters,
+                px=cls.counter_ttl,
+                channel=cls.channel,
+                message=message,
+        )
 
     @classmethod
     async def clear(cls, *args):
         if args:
-            await cls.cache.delete(*args)
+            await cls.invalidate_many(keys=args)
             return
 
-        await cls.cache.flushdb(asynchronous=True)
+        await cls.backend.flush()
+        await cls.publish("*")
+
+    @classmethod
+    async def purge(cls, *namespaces: str):
+        await cls.invalidate_many(namespaces=namespaces)
+
+    @classmethod
+    def drop_local(cls, *keys: str):
+        if "*" in keys:
+            cls.local.clear()
+        else:
+            cls.local.delete(*keys)
+
+    @classmethod
+    async def publish(cls, *keys: str):
+        if not cls.local or not keys:
+            return
+
+        cls.drop_local(*keys)
+        await cls.backend.publish(cls.channel, "\n".join(keys))
+
+    @classmethod
+    async def listen(cls):
+
+        # Runs in every worker for as long as the app is up
+        async for message in cls.backend.subscribe(cls.channel):
+            cls.drop_local(*message.split("\n"))
+
+    @classmethod
+    def stats(cls) -> dict:
+        stats = {
+            tier: {"hits": cls.hits[tier], "misses": cls.misses[tier]}
+            for tier in ("l1", "l2")
+        }
+        stats["l1"]["size"] = len(cls.local.data) if cls.local else 0
+
+        return stats
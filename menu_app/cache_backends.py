@@ -0,0 +1,396 @@
+"""Storage backends of menu_app.cache.Cache.
+
+Cache keeps its values, counters and locks in a backend chosen by
+CACHE_BACKEND:
+
+    redis   shared by all workers, at CACHE_URL
+    memory  bounded LRU of this process, CACHE_MEMORY_SIZE entries
+    null    stores nothing, every read is a miss
+
+Without CACHE_BACKEND it is "redis", which needs CACHE_URL: a missing
+URL is an error rather than a silent switch to memory. The memory
+backend is for a single process only, such as tests and benchmarks.
+With several workers each one would cache, lock and invalidate on its
+own, and serve entries other workers have already invalidated. Every
+method of a backend is one round trip to its storage; connections are
+opened by the first of them, not at import.
+"""
+import asyncio
+import os
+import time
+import typing
+from collections import OrderedDict
+
+from aioredis import from_url
+
+
+class Backend():
+
+    # Values are bytes, TTLs are in milliseconds. Counters are created
+    # by `incr` and are never evicted, only expired by the TTL they are
+    # given by `incr` and `set_many`.
+
+    async def get_many(self, *keys: str) -> list:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> bytes | None:
+        value, = await self.get_many(key)
+
+        return value
+
+    async def get_with_ttl(self, key: str) -> tuple:
+
+        # Value and its TTL left, with the meaning of Redis PTTL:
+        # -1 for no expiry and -2 for a missing key
+        raise NotImplementedError
+
+    async def pttl(self, key: str) -> int:
+        _, ttl = await self.get_with_ttl(key)
+
+        return ttl
+
+    async def set(
+            self,
+            key: str,
+            value: bytes,
+            px: int = None,
+            nx: bool = False,
+    ) -> bool:
+        raise NotImplementedError
+
+    async def set_many(self, items: list, touch=(), px: int = None):
+
+        # Items are (key, value, TTL) tuples. Counters in `touch`, if
+        # they exist, get the TTL `px` in the same round trip.
+        raise NotImplementedError
+
+    async def expire(self, key: str, px: int):
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def unlock(self, key: str, token: str):
+
+        # Deletes the key only while it still holds the token
+        raise NotImplementedError
+
+    async def incr(
+            self,
+            *keys: str,
+            px: int = None,
+            channel: str = None,
+            message: str = None,
+    ):
+
+        # Increments counters, sets their TTL to `px` if given, and
+        # publishes the message, if any, together
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        raise NotImplementedError
+        yield
+
+    async def flush(self):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class RedisBackend(Backend):
+
+    unlock_script = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) end return 0"
+    )
+
+    def __init__(self, url: str):
+        self.url = url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = from_url(
+                    self.url,
+                    encoding='latin-1',
+                    decode_responses=False)
+
+        return self._client
+
+    async def get_many(self, *keys: str) -> list:
+        return await self.client.mget(*keys)
+
+    async def get_with_ttl(self, key: str) -> tuple:
+        async with self.client.pipeline(transaction=False) as pipe:
+            value, ttl = await pipe.get(key).pttl(key).execute()
+
+        return value, ttl
+
+    async def set(
+            self,
+            key: str,
+            value: bytes,
+            px: int = None,
+            nx: bool = False,
+    ) -> bool:
+        return bool(await self.client.set(key, value, px=px, nx=nx))
+
+    async def set_many(self, items: list, touch=(), px: int = None):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value, ttl in items:
+                pipe.set(key, value, px=ttl)
+            if px:
+                for key in touch:
+                    pipe.pexpire(key, px)
+            await pipe.execute()
+
+    async def expire(self, key: str, px: int):
+        await self.client.pexpire(key, px)
+
+    async def exists(self, key: str) -> bool:
+        return bool(await self.client.exists(key))
+
+    async def unlock(self, key: str, token: str):
+        await self.client.eval(self.unlock_script, 1, key, token)
+
+    async def incr(
+            self,
+            *keys: str,
+            px: int = None,
+            channel: str = None,
+            message: str = None,
+    ):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.incr(key)
+                if px:
+                    pipe.pexpire(key, px)
+            if message is not None:
+                pipe.publish(channel, message)
+            await pipe.execute()
+
+    async def publish(self, channel: str, message: str):
+        await self.client.publish(channel, message)
+
+    async def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        async with self.client.pubsub() as pubsub:
+            await pubsub.subscribe(channel)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield message["data"].decode()
+
+    async def flush(self):
+        await self.client.flushdb(asynchronous=True)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class MemoryBackend(Backend):
+
+    # Values and locks share one LRU, counters are kept aside so that
+    # evictions can't restart them, with their expiry time like values.
+    # Subscribers are queues of this process, which is the only one to
+    # see the values anyway.
+
+    def __init__(self, size: int):
+        self.size = size
+        self.data = OrderedDict()
+        self.counters = dict()
+        self.subscribers = dict()
+
+    def _get(self, key: str) -> tuple:
+
+        # Value and its expiry time, None for no expiry
+        if key in self.counters:
+            counter, expires = self._counter(key)
+            if counter:
+                return str(counter).encode(), expires
+
+        entry = self.data.get(key)
+        if entry is None:
+            return None, None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.data[key]
+            return None, None
+        self.data.move_to_end(key)
+
+        return value, expires
+
+    def _counter(self, key: str) -> tuple:
+        counter, expires = self.counters.get(key, (0, None))
+        if expires is not None and expires <= time.monotonic():
+            del self.counters[key]
+            return 0, None
+
+        return counter, expires
+
+    def _set(self, key: str, value: bytes, px: int = None):
+        expires = time.monotonic() + px / 1000 if px else None
+        self.data[key] = (value, expires)
+        self.data.move_to_end(key)
+        while len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    async def get_many(self, *keys: str) -> list:
+        return [self._get(key)[0] for key in keys]
+
+    async def get_with_ttl(self, key: str) -> tuple:
+        value, expires = self._get(key)
+        if value is None:
+            return None, -2
+        if expires is None:
+            return value, -1
+
+        return value, int((expires - time.monotonic()) * 1000)
+
+    async def set(
+            self,
+            key: str,
+            value: bytes,
+            px: int = None,
+            nx: bool = False,
+    ) -> bool:
+        if nx and self._get(key)[0] is not None:
+            return False
+        if isinstance(value, str):
+            value = value.encode()
+        self._set(key, value, px)
+
+        return True
+
+    async def set_many(self, items: list, touch=(), px: int = None):
+        for key, value, ttl in items:
+            self._set(key, value, ttl)
+        if px:
+            for key in touch:
+                counter, _ = self._counter(key)
+                if counter:
+                    self.counters[key] = (
+                        counter, time.monotonic() + px / 1000,
+                    )
+
+    async def expire(self, key: str, px: int):
+        value, _ = self._get(key)
+        if value is not None and key not in self.counters:
+            self._set(key, value, px)
+
+    async def exists(self, key: str) -> bool:
+        return self._get(key)[0] is not None
+
+    async def unlock(self, key: str, token: str):
+        if self._get(key)[0] == token.encode():
+            del self.data[key]
+
+    async def incr(
+            self,
+            *keys: str,
+            px: int = None,
+            channel: str = None,
+            message: str = None,
+    ):
+        for key in keys:
+            counter, expires = self._counter(key)
+            if px:
+                expires = time.monotonic() + px / 1000
+            self.counters[key] = (counter + 1, expires)
+        if message is not None:
+            await self.publish(channel, message)
+
+    async def publish(self, channel: str, message: str):
+        for queue in self.subscribers.get(channel, ()):
+            queue.put_nowait(message)
+
+    async def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(channel, set()).add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.subscribers[channel].discard(queue)
+
+    async def flush(self):
+        self.data.clear()
+        self.counters.clear()
+
+
+class NullBackend(Backend):
+
+    # Caching turned off: writes are dropped, reads miss and locks are
+    # always free, so every request reads the database
+
+    async def get_many(self, *keys: str) -> list:
+        return [None] * len(keys)
+
+    async def get_with_ttl(self, key: str) -> tuple:
+        return None, -2
+
+    async def set(
+            self,
+            key: str,
+            value: bytes,
+            px: int = None,
+            nx: bool = False,
+    ) -> bool:
+        return True
+
+    async def set_many(self, items: list, touch=(), px: int = None):
+        pass
+
+    async def expire(self, key: str, px: int):
+        pass
+
+    async def exists(self, key: str) -> bool:
+        return False
+
+    async def unlock(self, key: str, token: str):
+        pass
+
+    async def incr(
+            self,
+            *keys: str,
+            px: int = None,
+            channel: str = None,
+            message: str = None,
+    ):
+        pass
+
+    async def publish(self, channel: str, message: str):
+        pass
+
+    async def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        await asyncio.Event().wait()
+        yield
+
+    async def flush(self):
+        pass
+
+
+def from_env() -> Backend:
+    name = os.environ.get('CACHE_BACKEND', "redis")
+    if name == "redis":
+        url = os.environ.get('CACHE_URL')
+        if not url:
+            raise ValueError(
+                    "CACHE_URL is not set: set it to the Redis server, or "
+                    "set CACHE_BACKEND to memory (single process only) or "
+                    "null"
+            )
+        return RedisBackend(url)
+    if name == "memory":
+        return MemoryBackend(
+                int(os.environ.get('CACHE_MEMORY_SIZE', 100000))
+        )
+    if name == "null":
+        return NullBackend()
+
+    raise ValueError(f"Unknown cache backend: {name}")
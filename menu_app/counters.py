@@ -0,0 +1,353 @@
+"""Denormalized submenu and dish counters.
+
+Counters are kept in the menu and submenu rows and updated by mapper
+events, so they change in the same transaction (and flush) as the
+submenu or dish that is inserted, moved or deleted, cascades included.
+A deleted submenu takes its dishes off the menu in one statement, and
+children deleted along with their parent shift nothing. Rows written
+around the ORM can make them drift; `reconcile` finds and fixes drifted
+counters in bulk, in the whole database or in some menus. Bulk inserts
+bypass the mapper events and shift the counters once per parent with
+`menu_shift` and `submenu_shift` instead. To reconcile:
+
+    python -m menu_app.counters
+"""
+import asyncio
+import typing
+
+from sqlalchemy import bindparam
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import inspect
+from sqlalchemy import or_
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import object_session
+from sqlmodel import select
+
+from menu_app.cache import Cache
+from menu_app.database import async_engine
+from menu_app.database import async_session
+from menu_app.models.dish_model import Dish
+from menu_app.models.menu_model import Menu
+from menu_app.models.submenu_model import Submenu
+
+CHUNK_SIZE = 1000
+
+
+def menu_shift(menu_id: int, submenus: int, dishes: int) -> list:
+    return [
+        update(Menu).where(Menu.id == menu_id).values(
+            submenus_count=Menu.submenus_count + submenus,
+            dishes_count=Menu.dishes_count + dishes,
+        ),
+    ]
+
+
+def submenu_shift(submenu_id: int, dishes: int) -> list:
+    return [
+        update(Submenu).where(Submenu.id == submenu_id).values(
+            dishes_count=Submenu.dishes_count + dishes,
+        ),
+        update(Menu).where(
+            Menu.id == select(Submenu.menu_id).where(
+                Submenu.id == submenu_id
+            ).scalar_subquery()
+        ).values(dishes_count=Menu.dishes_count + dishes),
+    ]
+
+
+def _shift_menu(connection, menu_id: int, submenus: int, dishes: int):
+    if menu_id is None:
+        return
+    for statement in menu_shift(menu_id, submenus, dishes):
+        connection.execute(statement)
+
+
+def _shift_submenu(connection, submenu_id: int, dishes: int):
+    if submenu_id is None:
+        return
+    for statement in submenu_shift(submenu_id, dishes):
+        connection.execute(statement)
+
+
+@event.listens_for(Submenu, "after_insert")
+def submenu_inserted(mapper, connection, target):
+    _shift_menu(connection, target.menu_id, 1, 0)
+
+
+@event.listens_for(Session, "before_flush")
+def deletions(session, flush_context, instances):
+
+    # Ids of the parents deleted by this flush. Deletes cascade when
+    # they are requested, so the children are in session.deleted too.
+    session.info["deleted"] = {
+        model: {
+            instance.id
+            for instance in session.deleted if isinstance(instance, model)
+        }
+        for model in (Menu, Submenu)
+    }
+
+
+@event.listens_for(Session, "after_flush")
+def deletions_done(session, flush_context):
+    session.info.pop("deleted", None)
+
+
+def _deleted(target, model) -> set:
+    session = object_session(target)
+    if session is None:
+        return set()
+
+    return session.info.get("deleted", {}).get(model, set())
+
+
+@event.listens_for(Submenu, "before_delete")
+def submenu_deleted(mapper, connection, target):
+
+    # Nothing to shift inside a menu deleted by the same flush. Else the
+    # menu loses the submenu and all its dishes in one UPDATE, while the
+    # submenu row still holds their count: cascaded dishes leave both
+    # counters alone.
+    if target.menu_id in _deleted(target, Menu):
+        return
+    connection.execute(
+            update(Menu).where(Menu.id == target.menu_id).values(
+                submenus_count=Menu.submenus_count - 1,
+                dishes_count=Menu.dishes_count - select(
+                    Submenu.dishes_count
+                ).where(Submenu.id == target.id).scalar_subquery(),
+            )
+    )
+
+
+@event.listens_for(Submenu, "after_update")
+def submenu_moved(mapper, connection, target):
+    history = inspect(target).attrs.menu_id.history
+    if not history.has_changes():
+        return
+    for menu_id in history.deleted:
+        _shift_menu(connection, menu_id, -1, -target.dishes_count)
+    for menu_id in history.added:
+        _shift_menu(connection, menu_id, 1, target.dishes_count)
+
+
+@event.listens_for(Dish, "after_insert")
+def dish_inserted(mapper, connection, target):
+    _shift_submenu(connection, target.submenu_id, 1)
+
+
+@event.listens_for(Dish, "after_delete")
+def dish_deleted(mapper, connection, target):
+    if target.submenu_id in _deleted(target, Submenu):
+        return
+    _shift_submenu(connection, target.submenu_id, -1)
+
+
+@event.listens_for(Dish, "after_update")
+def dish_moved(mapper, connection, target):
+    history = inspect(target).attrs.submenu_id.history
+    if not history.has_changes():
+        return
+    for submenu_id in history.deleted:
+        _shift_submenu(connection, submenu_id, -1)
+    for submenu_id in history.added:
+        _shift_submenu(connection, submenu_id, 1)
+
+
+def menu_counts(menu_ids: list = None):
+
+    # Actual counts per menu, aggregated before the join so menus
+    # with many dishes are not multiplied into many rows
+    submenus = select(
+            Submenu.menu_id,
+            func.count(Submenu.id).label("submenus_count"),
+    ).group_by(Submenu.menu_id)
+    dishes = select(
+            Submenu.menu_id,
+            func.count(Dish.id).label("dishes_count"),
+    ).join(Dish, Dish.submenu_id == Submenu.id).group_by(Submenu.menu_id)
+    query = select(Menu.id)
+    if menu_ids is not None:
+        submenus = submenus.where(Submenu.menu_id.in_(menu_ids))
+        dishes = dishes.where(Submenu.menu_id.in_(menu_ids))
+        query = query.where(Menu.id.in_(menu_ids))
+    submenus = submenus.subquery()
+    dishes = dishes.subquery()
+
+    return query.add_columns(
+            func.coalesce(submenus.c.submenus_count, 0).label(
+                "submenus_count"
+            ),
+            func.coalesce(dishes.c.dishes_count, 0).label("dishes_count"),
+    ).outerjoin(
+            submenus, submenus.c.menu_id == Menu.id
+    ).outerjoin(
+            dishes, dishes.c.menu_id == Menu.id
+    ).subquery()
+
+
+def submenu_counts(submenu_ids: list = None, menu_ids: list = None):
+    dishes = select(
+            Dish.submenu_id,
+            func.count(Dish.id).label("dishes_count"),
+    ).group_by(Dish.submenu_id)
+    query = select(Submenu.id)
+    if submenu_ids is not None:
+        dishes = dishes.where(Dish.submenu_id.in_(submenu_ids))
+        query = query.where(Submenu.id.in_(submenu_ids))
+    if menu_ids is not None:
+        dishes = dishes.join(Submenu, Dish.submenu_id == Submenu.id).where(
+                Submenu.menu_id.in_(menu_ids)
+        )
+        query = query.where(Submenu.menu_id.in_(menu_ids))
+    dishes = dishes.subquery()
+
+    return query.add_columns(
+            func.coalesce(dishes.c.dishes_count, 0).label("dishes_count"),
+    ).outerjoin(dishes, dishes.c.submenu_id == Submenu.id).subquery()
+
+
+async def drifted_menus(db: AsyncSession, menu_ids: list = None) -> list:
+    actual = menu_counts(menu_ids)
+    result = await db.execute(
+            select(
+                actual.c.id,
+                actual.c.submenus_count,
+                actual.c.dishes_count,
+            ).join(Menu, Menu.id == actual.c.id).where(or_(
+                Menu.submenus_count != actual.c.submenus_count,
+                Menu.dishes_count != actual.c.dishes_count,
+            ))
+    )
+
+    return [dict(row._mapping) for row in result.all()]
+
+
+async def drifted_submenus(
+        db: AsyncSession,
+        submenu_ids: list = None,
+        menu_ids: list = None,
+) -> list:
+    actual = submenu_counts(submenu_ids, menu_ids)
+    result = await db.execute(
+            select(
+                actual.c.id,
+                actual.c.dishes_count,
+                Submenu.menu_id,
+            ).join(Submenu, Submenu.id == actual.c.id).where(
+                Submenu.dishes_count != actual.c.dishes_count,
+            )
+    )
+
+    return [dict(row._mapping) for row in result.all()]
+
+
+async def fix(db: AsyncSession, menu_ids: list = None) -> tuple:
+    menus = await drifted_menus(db, menu_ids)
+    submenus = await drifted_submenus(db, menu_ids=menu_ids)
+
+    # Drifted rows are locked, submenus before menus like the counter
+    # updates do, and counted again. Writes that shifted a counter before
+    # the lock are committed and counted, the others wait for the lock
+    # and shift the new value, so none is lost between count and update.
+    if submenus:
+        ids = [row["id"] for row in submenus]
+        await db.execute(
+                select(Submenu.id).where(Submenu.id.in_(ids)).with_for_update()
+        )
+        submenus = await drifted_submenus(db, ids)
+    if menus:
+        ids = [row["id"] for row in menus]
+        await db.execute(
+                select(Menu.id).where(Menu.id.in_(ids)).with_for_update()
+        )
+        menus = await drifted_menus(db, ids)
+
+    # Only drifted rows are rewritten, with one executemany per table
+    if menus:
+        await db.execute(
+                update(Menu.__table__).where(
+                    Menu.__table__.c.id == bindparam("menu_id")
+                ).values(
+                    submenus_count=bindparam("actual_submenus"),
+                    dishes_count=bindparam("actual_dishes"),
+                ),
+                [
+                    {
+                        "menu_id": row["id"],
+                        "actual_submenus": row["submenus_count"],
+                        "actual_dishes": row["dishes_count"],
+                    }
+                    for row in menus
+                ],
+        )
+    if submenus:
+        await db.execute(
+                update(Submenu.__table__).where(
+                    Submenu.__table__.c.id == bindparam("submenu_id")
+                ).values(dishes_count=bindparam("actual_dishes")),
+                [
+                    {
+                        "submenu_id": row["id"],
+                        "actual_dishes": row["dishes_count"],
+                    }
+                    for row in submenus
+                ],
+        )
+
+    return menus, submenus
+
+
+async def reconcile(
+        db: AsyncSession,
+        menu_ids: typing.Iterable = None,
+) -> dict:
+
+    # The whole database, or only the given menus and their submenus,
+    # a chunk of ids at a time
+    if menu_ids is None:
+        scopes = [None]
+    else:
+        menu_ids = list(menu_ids)
+        scopes = [
+            menu_ids[start:start + CHUNK_SIZE]
+            for start in range(0, len(menu_ids), CHUNK_SIZE)
+        ]
+    menus = list()
+    submenus = list()
+    for scope in scopes:
+        fixed_menus, fixed_submenus = await fix(db, scope)
+        menus += fixed_menus
+        submenus += fixed_submenus
+    await db.commit()
+
+    keys = list()
+    for row in menus:
+        keys += [f"menu:{row['id']}", f"menu:{row['id']}/tree"]
+    for row in submenus:
+        keys += [
+            f"menu:{row['menu_id']}/submenu:{row['id']}",
+            f"menu:{row['menu_id']}/submenus",
+            f"menu:{row['menu_id']}/tree",
+        ]
+    if keys:
+        await Cache.clear(*keys, "menus", "tree")
+
+    return {"menus": len(menus), "submenus": len(submenus)}
+
+
+async def main():
+    async with async_session() as db:
+        fixed = await reconcile(db)
+    await async_engine.dispose()
+    print(
+        f"Fixed counters: {fixed['menus']} menus, "
+        f"{fixed['submenus']} submenus"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,60 +1,382 @@
+import asyncio
+import base64
+import contextlib
+import functools
+
+import orjson
 from fastapi import HTTPException
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 from sqlmodel import SQLModel
 
+from menu_app import counters  # noqa: F401 registers counter events
+from menu_app import metrics
 from menu_app.cache import Cache
+from menu_app.database import async_session
 
 
 class Crud_Base():
 
+    # Cache keys of nested entities are namespaced by their parents:
+    # "parents" are ids of the parent entities from the root down, as in
+    # the URL, and "path" is the same tuple read from the database.
+    # Cache keeps entities in the shape of read_model, not as ORM rows.
+
+    read_model = None
+    batch_size = 1000
+    refreshes = set()
+
+    @staticmethod
+    def parent(model: SQLModel):
+
+        # Column with id of parent entity, None for top level entities
+        return None
+
+    @staticmethod
+    def key(model: SQLModel, id: int, *parents: int) -> str:
+        return f"{model.__name__.lower()}:{id}"
+
+    @staticmethod
+    def list_key(model: SQLModel, *parents: int) -> str:
+        return f"{model.__name__.lower()}s"
+
     @staticmethod
-    async def count_dishes(db: AsyncSession, model: SQLModel):
-        pass
+    def subtree(model: SQLModel, id: int) -> list:
+
+        # Cache namespaces of the children removed together with entity
+        return [f"{model.__name__.lower()}:{id}"]
 
     @staticmethod
-    async def count_submenus(db: AsyncSession, model: SQLModel):
-        pass
+    def shift(parent_id: int, count: int) -> list:
+
+        # Counter updates for entities inserted around the mapper events
+        return []
 
     @classmethod
-    async def get(cls, db: AsyncSession, model: SQLModel, id: int):
-        cached_model = await Cache.get_data(f"{model.__name__.lower()}:{id}")
+    def ancestor_keys(cls, *path: int) -> list:
 
-        if cached_model:
-            return cached_model
+        # Cached parents and parent lists which counters include entity
+        return []
 
-        result = await db.get(model, id)
+    @staticmethod
+    def tree_key(menu_id: int = None) -> str:
+        return f"menu:{menu_id}/tree" if menu_id is not None else "tree"
+
+    @classmethod
+    def tree_keys(cls, id: int, *path: int) -> list:
+
+        # Trees which include the entity: the full one and the tree of
+        # its menu, which is the root of the path
+        return [cls.tree_key(), cls.tree_key((*path, id)[0])]
+
+    @classmethod
+    async def path(cls, db: AsyncSession, result: SQLModel) -> tuple:
+        return ()
+
+    @classmethod
+    async def is_path(cls, db: AsyncSession, parents: tuple) -> bool:
+
+        # Whether parents from the URL are real parents of each other,
+        # responses for made up paths are not cached
+        return True
+
+    @staticmethod
+    def cursor(id: int) -> str:
+
+        # Cursors are opaque to clients, only the id of the last entity
+        # of a page is encoded in them
+        return base64.urlsafe_b64encode(str(id).encode()).decode().rstrip("=")
+
+    @staticmethod
+    def after_id(cursor: str) -> int:
+        try:
+            return int(base64.urlsafe_b64decode(
+                    cursor + "=" * (-len(cursor) % 4)
+            ))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
+
+    @staticmethod
+    def matches(etag: str, if_none_match: str = None) -> bool:
+        if not if_none_match:
+            return False
+
+        return etag in (
+            tag.strip().removeprefix("W/")
+            for tag in if_none_match.split(",")
+        )
+
+    @staticmethod
+    def cached_response(body: bytes, etag: str) -> Response:
+
+        # Cached body is already the JSON of read_model, so it is sent
+        # as is, without validation by response_model and encoding
+        return Response(
+                content=body,
+                media_type="application/json",
+                headers={"ETag": etag},
+        )
+
+    @classmethod
+    async def cached(
+            cls,
+            key: str,
+            if_none_match: str = None,
+            load=None,
+            *args,
+    ):
+
+        # Stored key is resolved once and before the database is read:
+        # a write committed meanwhile bumps the version, so the value
+        # saved under the key can't outlive the body. ETags are hashes of
+        # the cached bodies, a 304 is only sent for the body in cache.
+        stored, = await Cache.resolve(key)
+        body, etag, stale = await Cache.get_entry(key, stored)
+        if body is None:
+            return None, stored
+
+        if stale:
+            cls.revalidate(key, stored, load, *args)
+        if cls.matches(etag, if_none_match):
+            return Response(status_code=304, headers={"ETag": etag}), stored
+
+        return cls.cached_response(body, etag), stored
+
+    @classmethod
+    def revalidate(cls, key: str, stored: str, load, *args):
+
+        # Stale body has been served, it is reloaded in background with
+        # a session of its own, the one of the request is closed by then
+        async def refresh():
+            async with async_session() as db:
+                with contextlib.suppress(HTTPException):
+                    await Cache.single_flight(
+                            key,
+                            functools.partial(load, key, stored, db, *args),
+                            stored,
+                    )
+
+        task = asyncio.create_task(refresh())
+        cls.refreshes.add(task)
+        task.add_done_callback(cls.refreshes.discard)
+
+    @classmethod
+    async def build(cls, key: str, stored: str, load, *args):
+
+        # Only one request per key loads it from the database at a time,
+        # the others get the same result, see Cache.single_flight
+        result = await Cache.single_flight(
+                key, functools.partial(load, key, stored, *args), stored
+        )
+        if isinstance(result, bytes):
+            return cls.cached_response(result, Cache.etag(result))
+
+        return result
+
+    @classmethod
+    async def load(
+            cls,
+            key: str,
+            stored: str,
+            db: AsyncSession,
+            model: SQLModel,
+            id: int,
+            *parents: int,
+    ):
+
+        # Counters may have been changed by other writes of this session,
+        # so a row from the identity map is refreshed from the database
+        result = await db.get(model, id, populate_existing=True)
         if not result:
             raise HTTPException(
                     status_code=404,
                     detail=f"{model.__name__.lower()} not found"
             )
-        await Cache.save(f"{model.__name__.lower()}:{id}", result)
-        return result
+        if await cls.path(db, result) != parents:
+            return cls.read_model.from_orm(result)
+
+        return await Cache.save(
+                key, cls.read_model.from_orm(result), stored
+        )
+
+    @classmethod
+    async def load_list(
+            cls,
+            key: str,
+            stored: str,
+            db: AsyncSession,
+            query,
+            limit: int,
+            *parents: int,
+    ):
+        result = await db.execute(
+                query.execution_options(populate_existing=True)
+        )
+        result_data = [
+            cls.read_model.from_orm(row) for row in result.scalars().all()
+        ]
+        if limit is not None:
+            result_data = {
+                "items": result_data[:limit],
+                "next": (
+                    cls.cursor(result_data[limit - 1].id)
+                    if len(result_data) > limit else None
+                ),
+            }
+        if not await cls.is_path(db, parents):
+            return result_data
+
+        return await Cache.save(key, result_data, stored)
 
     @classmethod
-    async def get_list(cls, db: AsyncSession, model: SQLModel):
-        cached_model = await Cache.get_data(f"{model.__name__.lower()}")
+    @metrics.tracked
+    async def get(
+            cls,
+            db: AsyncSession,
+            model: SQLModel,
+            id: int,
+            *parents: int,
+            if_none_match: str = None,
+    ):
+        key = cls.key(model, id, *parents)
+        response, stored = await cls.cached(
+                key, if_none_match, cls.load, model, id, *parents
+        )
 
-        if cached_model:
-            return cached_model
+        if response is not None:
+            return response
 
-        result = await db.execute(select(model))
-        result_data = result.scalars().all()
-        await Cache.save(f"{model.__name__.lower()}", result)
+        return await cls.build(
+                key, stored, cls.load, db, model, id, *parents
+        )
 
-        return result_data
+    @classmethod
+    async def stream(cls, db: AsyncSession, query):
+        result = await db.stream_scalars(query.execution_options(
+                yield_per=cls.batch_size,
+                populate_existing=True,
+        ))
+        async for rows in result.partitions():
+            yield b"".join(
+                    orjson.dumps(
+                        cls.read_model.from_orm(row),
+                        default=Cache.default,
+                    ) + b"\n"
+                    for row in rows
+            )
 
-    async def create(db: AsyncSession, model: SQLModel, data):
+    @classmethod
+    @metrics.tracked
+    async def get_list(
+            cls,
+            db: AsyncSession,
+            model: SQLModel,
+            *parents: int,
+            limit: int = None,
+            after: str = None,
+            if_none_match: str = None,
+            ndjson: bool = False,
+    ):
+        key = cls.list_key(model, *parents)
+        query = select(model).order_by(model.id)
+        if cls.parent(model) is not None:
+            query = query.where(cls.parent(model) == parents[-1])
+
+        # Whole lists can be streamed as NDJSON straight from the cursor,
+        # bypassing the cache, instead of building one JSON array
+        if ndjson and limit is None:
+            return StreamingResponse(
+                    cls.stream(db, query),
+                    media_type="application/x-ndjson",
+            )
+
+        # Keyset pagination: a page starts right after the id in cursor,
+        # so with the (parent, id) index every page costs the same
+        if limit is not None:
+            after_id = cls.after_id(after) if after else 0
+            key += f"?after={after_id}&limit={limit}"
+            query = query.where(model.id > after_id).limit(limit + 1)
+
+        response, stored = await cls.cached(
+                key, if_none_match, cls.load_list, query, limit, *parents
+        )
+        if response is not None:
+            return response
+
+        return await cls.build(
+                key, stored, cls.load_list, db, query, limit, *parents
+        )
+
+    @classmethod
+    @metrics.tracked
+    async def create(
+            cls,
+            db: AsyncSession,
+            model: SQLModel,
+            data,
+            id: int = None,
+    ):
         result = model.from_orm(data)
+        if cls.parent(model) is not None:
+            setattr(result, cls.parent(model).key, id)
         db.add(result)
         await db.commit()
         await db.refresh(result)
-        await Cache.clear(f"{model.__name__.lower()}")
+
+        path = await cls.path(db, result)
+        await Cache.clear(
+                cls.list_key(model, *path),
+                *cls.ancestor_keys(*path),
+                *cls.tree_keys(result.id, *path),
+        )
 
         return result
 
-    async def update(db: AsyncSession, model: SQLModel, data, id: int):
+    @classmethod
+    @metrics.tracked
+    async def create_many(cls, db: AsyncSession, model: SQLModel, data, id):
+        result = [model.from_orm(item) for item in data]
+        for row in result:
+            setattr(row, cls.parent(model).key, id)
+        if not result:
+            return []
+
+        # Where the database can return inserted rows, they go in multi-row
+        # INSERT ... RETURNING of batch_size rows, under the limit of bound
+        # parameters per statement, and counters are shifted once.
+        # Otherwise rows are added in one flush and counted by mapper events.
+        if db.bind.dialect.full_returning:
+            table = model.__table__
+            rows = [row.dict(exclude={"id"}) for row in result]
+            result = list()
+            for start in range(0, len(rows), cls.batch_size):
+                inserted = await db.execute(
+                        insert(table).values(
+                            rows[start:start + cls.batch_size]
+                        ).returning(*table.c)
+                )
+                result += [model(**row._mapping) for row in inserted.all()]
+            for statement in cls.shift(id, len(result)):
+                await db.execute(statement)
+        else:
+            db.add_all(result)
+        await db.commit()
+
+        path = await cls.path(db, result[0])
+        await Cache.clear(
+                cls.list_key(model, *path),
+                *cls.ancestor_keys(*path),
+                *cls.tree_keys(result[0].id, *path),
+        )
+
+        return result
+
+    @classmethod
+    @metrics.tracked
+    async def update(cls, db: AsyncSession, model: SQLModel, data, id: int):
         result = await db.get(model, id)
         if not result:
             raise HTTPException(
@@ -69,19 +391,40 @@ class Crud_Base():
         db.add(result)
         await db.commit()
         await db.refresh(result)
-        await Cache.save(f"{model.__name__.lower()}:{id}", result)
-        await Cache.clear(f"{model.__name__.lower()}s")
+
+        # Entity itself and the list of its parent, counters are unchanged
+        path = await cls.path(db, result)
+        await Cache.clear(
+                cls.key(model, id, *path),
+                cls.list_key(model, *path),
+                *cls.tree_keys(id, *path),
+        )
 
         return result
 
-    async def delete(db: AsyncSession, model: SQLModel, id: int):
+    @classmethod
+    @metrics.tracked
+    async def delete(cls, db: AsyncSession, model: SQLModel, id: int):
         result = await db.get(model, id)
         if not result:
             raise HTTPException(
                     status_code=404,
                     detail=f"{model.__name__.lower()} not found"
             )
+
+        # Path is read before the parents can be gone from the database
+        path = await cls.path(db, result)
         await db.delete(result)
         await db.commit()
-        await Cache.clear()
+
+        # Keys and the subtree are invalidated in one round trip
+        await Cache.invalidate_many(
+                keys=[
+                    cls.key(model, id, *path),
+                    cls.list_key(model, *path),
+                    *cls.ancestor_keys(*path),
+                    *cls.tree_keys(id, *path),
+                ],
+                namespaces=cls.subtree(model, id),
+        )
         return {"ok": True}
@@ -3,44 +3,73 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 from sqlmodel import SQLModel
 
+from menu_app import counters
+from menu_app import metrics
 from menu_app.cache import Cache
 from menu_app.crud.crud_base import Crud_Base
+from menu_app.crud.crud_submenu import SubmenuCrud
 from menu_app.models.dish_model import Dish
-from menu_app.models.dish_model import DishCreate
+from menu_app.models.dish_model import DishRead
 from menu_app.models.dish_model import DishUpdate
+from menu_app.models.submenu_model import Submenu
 
 
 class DishCrud(Crud_Base):
 
-    @classmethod
-    async def get_list(cls, db: AsyncSession, model: SQLModel, id: int = None):
-        cached_model = await Cache.get_data(f"{model.__name__.lower()}")
+    read_model = DishRead
 
-        if cached_model:
-            return cached_model
+    @staticmethod
+    def parent(model: SQLModel):
+        return model.submenu_id
 
-        result = await db.execute(select(model).where(model.submenu_id == id))
-        result_data = result.scalars().all()
-        await Cache.save(f"{model.__name__.lower()}", result_data)
+    @staticmethod
+    def key(model: SQLModel, id: int, menu_id: int, submenu_id: int) -> str:
+        return f"menu:{menu_id}/submenu:{submenu_id}/dish:{id}"
 
-        return result_data
+    @staticmethod
+    def list_key(model: SQLModel, menu_id: int, submenu_id: int) -> str:
+        return f"menu:{menu_id}/submenu:{submenu_id}/dishes"
 
-    async def create(
-            db: AsyncSession,
-            model: SQLModel,
-            data: DishCreate,
-            id: int
-    ):
-        result = model.from_orm(data)
-        result.submenu_id = id
-        db.add(result)
-        await db.commit()
-        await db.refresh(result)
-        await Cache.clear(f"{model.__name__.lower()}")
+    @staticmethod
+    def subtree(model: SQLModel, id: int) -> list:
+        return []
 
-        return result
+    @staticmethod
+    def shift(submenu_id: int, count: int) -> list:
+        return counters.submenu_shift(submenu_id, count)
 
+    @classmethod
+    def ancestor_keys(cls, menu_id: int, submenu_id: int) -> list:
+        return [
+            SubmenuCrud.key(Submenu, submenu_id, menu_id),
+            SubmenuCrud.list_key(Submenu, menu_id),
+            *SubmenuCrud.ancestor_keys(menu_id),
+        ]
+
+    @classmethod
+    async def path(cls, db: AsyncSession, result: SQLModel) -> tuple:
+        menu_id = await db.scalar(
+                select(Submenu.menu_id).where(Submenu.id == result.submenu_id)
+        )
+
+        return menu_id, result.submenu_id
+
+    @classmethod
+    async def is_path(cls, db: AsyncSession, parents: tuple) -> bool:
+        menu_id, submenu_id = parents
+        submenu = await db.scalar(
+                select(Submenu.id).where(
+                    Submenu.id == submenu_id,
+                    Submenu.menu_id == menu_id,
+                )
+        )
+
+        return submenu is not None
+
+    @classmethod
+    @metrics.tracked
     async def update(
+            cls,
             db: AsyncSession,
             model: SQLModel,
             data: DishUpdate,
@@ -56,7 +85,12 @@ class DishCrud(Crud_Base):
         db.add(result)
         await db.commit()
         await db.refresh(result)
-        await Cache.save(f"{model.__name__.lower()}:{id}", result)
-        await Cache.clear(f"{model.__name__.lower()}")
+
+        path = await cls.path(db, result)
+        await Cache.clear(
+                cls.key(model, id, *path),
+                cls.list_key(model, *path),
+                *cls.tree_keys(id, *path),
+        )
 
         return result
@@ -1,75 +1,65 @@
 from fastapi import HTTPException
-from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from sqlmodel import select
-from sqlmodel import SQLModel
 
+from menu_app import metrics
 from menu_app.cache import Cache
 from menu_app.crud.crud_base import Crud_Base
-from menu_app.models.dish_model import Dish
+from menu_app.models.menu_model import Menu
+from menu_app.models.menu_model import MenuRead
+from menu_app.models.menu_model import MenuTree
 from menu_app.models.submenu_model import Submenu
 
 
 class MenuCrud(Crud_Base):
 
-    @staticmethod
-    async def count_submenus(db: AsyncSession, model: SQLModel):
-        result = await db.execute(
-                select([func.count(Submenu.id)]
-                       ).where(Submenu.menu_id == model.id)
-                 )
-        model.submenus_count = result.scalars().one()
-
-    @staticmethod
-    async def count_dishes(db: AsyncSession, model: SQLModel):
-        result = await db.execute(
-                select(
-                    [func.count(Dish.id)]
-                ).join(Submenu).where(Submenu.menu_id == model.id)
-        )
-        model.dishes_count = result.scalars().one()
+    # Menu reads are primary key lookups: submenus and dishes counters
+    # are stored in the menu row and kept up to date by menu_app.counters
+    read_model = MenuRead
 
     @classmethod
-    async def get(cls, db: AsyncSession, model: SQLModel, id: int):
-        cached_model = await Cache.get_data(f"{model.__name__.lower()}:{id}")
-
-        if cached_model:
-            return cached_model
-
-        result = await db.get(model, id)
+    @metrics.tracked
+    async def get_tree(
+            cls,
+            db: AsyncSession,
+            menu_id: int = None,
+            if_none_match: str = None,
+    ):
+        key = cls.tree_key(menu_id)
+        response, stored = await cls.cached(
+                key, if_none_match, cls.load_tree, menu_id
+        )
 
-        if not result:
-            raise HTTPException(
-                    status_code=404,
-                    detail=f"{model.__name__.lower()} not found"
-            )
-        await cls.count_submenus(db, result)
-        await cls.count_dishes(db, result)
-        db.add(result)
-        await db.commit()
-        await db.refresh(result)
-        await Cache.save(f"{model.__name__.lower()}:{id}", result)
+        if response is not None:
+            return response
 
-        return await db.get(model, id)
+        return await cls.build(key, stored, cls.load_tree, db, menu_id)
 
     @classmethod
-    async def get_list(cls, db: AsyncSession, model: SQLModel):
-        cached_model = await Cache.get_data(f"{model.__name__.lower()}")
-
-        if cached_model:
-            return cached_model
-
-        menus = await db.execute(select(model))
-        result_data = list()
-        for menu in menus.scalars().all():
-            await cls.count_submenus(db, menu)
-            await cls.count_dishes(db, menu)
-            db.add(menu)
-            await db.commit()
-            await db.refresh(menu)
+    async def load_tree(
+            cls,
+            key: str,
+            stored: str,
+            db: AsyncSession,
+            menu_id: int,
+    ):
+
+        # Menus, their submenus and dishes are loaded with one query per
+        # level, whatever the number of entities, and cached as one value
+        query = select(Menu).options(
+                selectinload(Menu.submenus).selectinload(Submenu.dishes)
+        ).order_by(Menu.id)
+        if menu_id is not None:
+            query = query.where(Menu.id == menu_id)
 
-            result_data.append(menu)
-
-        await Cache.save(f"{model.__name__.lower()}", result_data)
+        result = await db.execute(
+                query.execution_options(populate_existing=True)
+        )
+        tree = [MenuTree.from_orm(menu) for menu in result.scalars().all()]
+        if menu_id is not None:
+            if not tree:
+                raise HTTPException(status_code=404, detail="menu not found")
+            tree = tree[0]
 
-        return result_data
+        return await Cache.save(key, tree, stored)
@@ -1,8 +1,12 @@
 import os
+import time
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.pool import QueuePool
 from sqlmodel import delete
 
 from menu_app.models.dish_model import Dish
@@ -12,26 +16,96 @@ from menu_app.models.submenu_model import Submenu
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
-# Create async engine for DB
-async_engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+# Time spent by checkouts waiting for a free connection of the pool
+waits = {"count": 0, "total": 0.0, "max": 0.0}
+checkouts = {"count": 0}
 
 
-async def get_session() -> AsyncSession:
-    async_session = sessionmaker(
-            async_engine,
-            class_=AsyncSession,
-            expire_on_commit=False
+class TimedPool(AsyncAdaptedQueuePool):
+
+    # Queue pool which records how long every checkout waited
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            waits["count"] += 1
+            waits["total"] += waited
+            waits["max"] = max(waits["max"], waited)
+
+
+def engine_options() -> dict:
+    options = {
+        "echo": bool(int(os.environ.get("DB_ECHO", 0))),
+        "future": True,
+    }
+
+    # SQLite gets the pool of its dialect, pool options don't apply to it
+    if DATABASE_URL.startswith("sqlite"):
+        return options
+
+    options.update(
+            poolclass=TimedPool,
+            pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+            pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+            pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", -1)),
+            pool_pre_ping=bool(int(os.environ.get("DB_POOL_PRE_PING", 0))),
     )
 
-    # Return async generator for database connection
+    return options
+
+
+# Create async engine for DB and one session factory for the process
+async_engine = create_async_engine(DATABASE_URL, **engine_options())
+async_session = sessionmaker(
+        async_engine,
+        class_=AsyncSession,
+        expire_on_commit=False
+)
+
+
+@event.listens_for(async_engine.sync_engine, "checkout")
+def connection_checked_out(dbapi_connection, record, proxy):
+    checkouts["count"] += 1
+
+
+async def get_session() -> AsyncSession:
+
+    # Session is lazy: a connection is checked out by the first statement
+    # and returned on commit or close, so requests answered from cache
+    # never take one from the pool. Nothing may touch the session before
+    # the cache is checked.
     async with async_session() as session:
         yield session
 
 
+def pool_stats() -> dict:
+    pool = async_engine.sync_engine.pool
+    stats = {"pool": type(pool).__name__, "checkouts": checkouts["count"]}
+    if isinstance(pool, QueuePool):
+        stats.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=max(pool.overflow(), 0),
+        )
+    stats["waits"] = {
+        "count": waits["count"],
+        "avg_ms": (
+            waits["total"] / waits["count"] * 1000 if waits["count"] else 0
+        ),
+        "max_ms": waits["max"] * 1000,
+    }
+
+    return stats
+
+
 async def clear_db():
 
     # Clear DB when app is shutdown
-    async with AsyncSession(async_engine) as session:
+    async with async_session() as session:
         await session.execute(delete(Dish))
         await session.execute(delete(Submenu))
         await session.execute(delete(Menu))
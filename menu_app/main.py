@@ -1,15 +1,32 @@
+import asyncio
+import os
 from typing import List
+from typing import Optional
+from typing import Union
 
 from fastapi import Depends
 from fastapi import FastAPI
+from fastapi import Header
+from fastapi import Query
+from fastapi import Request
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY
+from prometheus_client import generate_latest
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from menu_app import metrics
+from menu_app import transfer
+from menu_app import warmup
 from menu_app.cache import Cache
 from menu_app.crud.crud_dish import DishCrud
 from menu_app.crud.crud_menu import MenuCrud
 from menu_app.crud.crud_submenu import SubmenuCrud
 from menu_app.database import clear_db
 from menu_app.database import get_session
+from menu_app.database import pool_stats
 from menu_app.models.dish_model import Dish
 from menu_app.models.dish_model import DishCreate
 from menu_app.models.dish_model import DishRead
@@ -17,7 +34,9 @@ from menu_app.models.dish_model import DishUpdate
 from menu_app.models.menu_model import Menu
 from menu_app.models.menu_model import MenuCreate
 from menu_app.models.menu_model import MenuRead
+from menu_app.models.menu_model import MenuTree
 from menu_app.models.menu_model import MenuUpdate
+from menu_app.models.page_model import Page
 from menu_app.models.submenu_model import Submenu
 from menu_app.models.submenu_model import SubmenuCreate
 from menu_app.models.submenu_model import SubmenuRead
@@ -25,11 +44,81 @@ from menu_app.models.submenu_model import SubmenuUpdate
 
 app = FastAPI()
 
+app.add_middleware(metrics.RouteMetrics)
+
+REGISTRY.register(metrics.PoolCollector(pool_stats))
+
+
+@app.on_event("startup")
+async def on_startup():
+
+    # The cache backend is chosen here, a missing setting fails startup.
+    # Local cache of this worker follows invalidations of other workers.
+    if Cache.local:
+        app.state.cache_listener = asyncio.create_task(Cache.listen())
+
+    # Requests are served while the cache is warmed, see /api/v1/ready
+    if int(os.environ.get("CACHE_WARM", 0)):
+        app.state.warmup = warmup.start()
+
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    if Cache.local:
+        app.state.cache_listener.cancel()
     await clear_db()
     await Cache.clear()
+    await Cache.backend.close()
+
+
+def preference(accept: str, media_type: str) -> tuple:
+
+    # Quality the Accept header gives the media type, from its most
+    # specific matching range, and how specific that range is
+    type, _, subtype = media_type.partition("/")
+    best = (0.0, -1)
+    for media_range in accept.split(","):
+        media, *params = media_range.split(";")
+        range_type, _, range_subtype = media.strip().lower().partition("/")
+        if (range_type, range_subtype) == (type, subtype):
+            specificity = 2
+        elif (range_type, range_subtype) == (type, "*"):
+            specificity = 1
+        elif (range_type, range_subtype) == ("*", "*"):
+            specificity = 0
+        else:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if specificity > best[1] or (
+                specificity == best[1] and quality > best[0]
+        ):
+            best = (quality, specificity)
+
+    return best
+
+
+def accepts_ndjson(accept: Optional[str] = Header(default=None)) -> bool:
+
+    # NDJSON is sent when the client prefers it to JSON: a higher
+    # quality, or the same one from a more specific range. Ties, "*/*"
+    # and no Accept at all get JSON.
+    if not accept:
+        return False
+    ndjson = preference(accept, "application/x-ndjson")
+
+    return ndjson[0] > 0 and ndjson > preference(accept, "application/json")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/")
@@ -38,20 +127,111 @@ async def root():
     return {"message": ("Hello, everyone! It's simple food menu. Let's play!")}
 
 
-@app.get("/api/v1/menus", response_model=List[MenuRead])
+@app.get("/api/v1/cache/stats")
+async def cache_stats():
+    return Cache.stats()
+
+
+@app.post("/api/v1/cache/warm", status_code=202)
+async def warm_cache():
+    task = warmup.start()
+    if task is not None:
+        app.state.warmup = task
+    return warmup.state
+
+
+@app.get("/api/v1/ready")
+async def ready():
+    if warmup.state["status"] in ("warming", "failed"):
+        return JSONResponse(status_code=503, content=warmup.state)
+    return {**warmup.state, "status": "ready"}
+
+
+@app.get("/api/v1/db/pool")
+async def db_pool():
+    return pool_stats()
+
+
+@app.get("/api/v1/export")
+async def export_menus(
+        *,
+        session: AsyncSession = Depends(get_session),
+        format: str = Query(default="jsonl", regex="^(jsonl|csv)$"),
+):
+    return StreamingResponse(
+            transfer.export(session, format),
+            media_type=(
+                "text/csv" if format == "csv" else "application/x-ndjson"
+            ),
+    )
+
+
+@app.post("/api/v1/import", status_code=201)
+async def import_menus(
+        *,
+        session: AsyncSession = Depends(get_session),
+        request: Request,
+):
+    format = (
+        "csv"
+        if request.headers.get("content-type", "").startswith("text/csv")
+        else "jsonl"
+    )
+    return await transfer.load(session, request.stream(), format)
+
+
+@app.get(
+    "/api/v1/menus",
+    response_model=Union[List[MenuRead], Page[MenuRead]],
+)
 async def read_menus(
         *,
         session: AsyncSession = Depends(get_session),
+        limit: Optional[int] = Query(default=None, ge=1, le=1000),
+        after: Optional[str] = None,
+        if_none_match: Optional[str] = Header(default=None),
+        ndjson: bool = Depends(accepts_ndjson),
+):
+    return await MenuCrud.get_list(
+            session, Menu,
+            limit=limit,
+            after=after,
+            if_none_match=if_none_match,
+            ndjson=ndjson,
+    )
+
+
+@app.get("/api/v1/menus/tree", response_model=List[MenuTree])
+async def read_tree(
+        *,
+        session: AsyncSession = Depends(get_session),
+        if_none_match: Optional[str] = Header(default=None),
 ):
-    return await MenuCrud.get_list(session, Menu)
+    return await MenuCrud.get_tree(session, if_none_match=if_none_match)
+
+
+@app.get("/api/v1/menus/{menu_id}/tree", response_model=MenuTree)
+async def read_menu_tree(
+        *, menu_id: int,
+        session: AsyncSession = Depends(get_session),
+        if_none_match: Optional[str] = Header(default=None),
+):
+    return await MenuCrud.get_tree(
+            session, menu_id,
+            if_none_match=if_none_match,
+    )
 
 
 @app.get("/api/v1/menus/{menu_id}", response_model=MenuRead)
 async def read_menu(
         *, menu_id: int,
         session: AsyncSession = Depends(get_session),
+        if_none_match: Optional[str] = Header(default=None),
 ):
-    return await MenuCrud.get(session, Menu, menu_id)
+    return await MenuCrud.get(
+            session, Menu, menu_id,
+            if_none_match=if_none_match,
+    )
 
 
 @app.post("/api/v1/menus", response_model=MenuRead, status_code=201)
@@ -82,13 +262,26 @@ async def delete_menu(
     return await MenuCrud.delete(session, Menu, menu_id)
 
 
-@app.get("/api/v1/menus/{menu_id}/submenus", response_model=List[SubmenuRead])
+@app.get(
+    "/api/v1/menus/{menu_id}/submenus",
+    response_model=Union[List[SubmenuRead], Page[SubmenuRead]],
+)
 async def read_submenus(
         *,
         session: AsyncSession = Depends(get_session),
-        menu_id: int
+        menu_id: int,
+        limit: Optional[int] = Query(default=None, ge=1, le=1000),
+        after: Optional[str] = None,
+        if_none_match: Optional[str] = Header(default=None),
+        ndjson: bool = Depends(accepts_ndjson),
 ):
-    return await SubmenuCrud.get_list(session, Submenu, menu_id)
+    return await SubmenuCrud.get_list(
+            session, Submenu, menu_id,
+            limit=limit,
+            after=after,
+            if_none_match=if_none_match,
+            ndjson=ndjson,
+    )
 
 
 @app.get(
@@ -98,9 +291,14 @@ async def read_submenus(
 async def read_submenu(
         *,
         session: AsyncSession = Depends(get_session),
+        menu_id: int,
         submenu_id: int,
+        if_none_match: Optional[str] = Header(default=None),
 ):
-    return await SubmenuCrud.get(session, Submenu, submenu_id)
+    return await SubmenuCrud.get(
+            session, Submenu, submenu_id, menu_id,
+            if_none_match=if_none_match,
+    )
 
 
 @app.post(
@@ -117,6 +315,20 @@ async def create_submenu(
     return await SubmenuCrud.create(session, Submenu, data, menu_id)
 
 
+@app.post(
+    "/api/v1/menus/{menu_id}/submenus/bulk",
+    response_model=List[SubmenuRead],
+    status_code=201,
+)
+async def create_submenus(
+        *,
+        session: AsyncSession = Depends(get_session),
+        data: List[SubmenuCreate],
+        menu_id: int,
+):
+    return await SubmenuCrud.create_many(session, Submenu, data, menu_id)
+
+
 @app.patch(
     "/api/v1/menus/{menu_id}/submenus/{submenu_id}",
     response_model=SubmenuUpdate,
@@ -141,14 +353,25 @@ async def delete_submenu(
 
 @app.get(
     "/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes",
-    response_model=List[DishRead],
+    response_model=Union[List[DishRead], Page[DishRead]],
 )
 async def read_dishes(
         *,
         session: AsyncSession = Depends(get_session),
+        menu_id: int,
         submenu_id: int,
+        limit: Optional[int] = Query(default=None, ge=1, le=1000),
+        after: Optional[str] = None,
+        if_none_match: Optional[str] = Header(default=None),
+        ndjson: bool = Depends(accepts_ndjson),
 ):
-    return await DishCrud.get_list(session, Dish, submenu_id)
+    return await DishCrud.get_list(
+            session, Dish, menu_id, submenu_id,
+            limit=limit,
+            after=after,
+            if_none_match=if_none_match,
+            ndjson=ndjson,
+    )
 
 
 @app.get(
@@ -158,9 +381,15 @@ async def read_dishes(
 async def read_dish(
         *,
         session: AsyncSession = Depends(get_session),
+        menu_id: int,
+        submenu_id: int,
         dish_id: int,
+        if_none_match: Optional[str] = Header(default=None),
 ):
-    return await DishCrud.get(session, Dish, dish_id)
+    return await DishCrud.get(
+            session, Dish, dish_id, menu_id, submenu_id,
+            if_none_match=if_none_match,
+    )
 
 
 @app.post(
@@ -177,6 +406,20 @@ async def create_dish(
     return await DishCrud.create(session, Dish, data, submenu_id)
 
 
+@app.post(
+        "/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/bulk",
+        response_model=List[DishRead],
+        status_code=201,
+)
+async def create_dishes(
+        *,
+        session: AsyncSession = Depends(get_session),
+        data: List[DishCreate],
+        submenu_id: int,
+):
+    return await DishCrud.create_many(session, Dish, data, submenu_id)
+
+
 @app.patch(
     "/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}",
     response_model=DishUpdate
@@ -0,0 +1,190 @@
+"""Prometheus metrics of routes, cache and database, served at /metrics.
+
+Route metrics are labelled by the route template, cache metrics by the
+key prefix (the kind of the cached value: "menu", "dishes", "tree"...)
+and SQL metrics by the CRUD method which ran the statement.
+"""
+import contextlib
+import contextvars
+import functools
+import time
+import typing
+
+from prometheus_client import Counter
+from prometheus_client import Histogram
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_LATENCY = Histogram(
+        "http_request_duration_seconds",
+        "Request latency by route",
+        ["method", "route"],
+)
+REQUESTS = Counter(
+        "http_requests",
+        "Requests by route and status code",
+        ["method", "route", "status"],
+)
+CACHE_REQUESTS = Counter(
+        "cache_requests",
+        "Cache lookups by key prefix and result (hit or miss) and failed "
+        "cache operations (error)",
+        ["prefix", "result"],
+)
+CACHE_LATENCY = Histogram(
+        "cache_operation_duration_seconds",
+        "Cache operation latency by key prefix",
+        ["prefix", "operation"],
+)
+SQL_QUERIES = Counter(
+        "sql_queries",
+        "SQL statements by CRUD method",
+        ["method"],
+)
+SQL_LATENCY = Histogram(
+        "sql_query_duration_seconds",
+        "SQL statement latency by CRUD method",
+        ["method"],
+)
+
+# CRUD method running in the current request, see `tracked`
+crud_method = contextvars.ContextVar("crud_method", default="none")
+
+
+def prefix(key: str) -> str:
+
+    # "menu:1/submenu:2/dishes?after=0&limit=10" -> "dishes"
+    return key.split("/")[-1].partition("?")[0].partition(":")[0]
+
+
+@contextlib.contextmanager
+def cache_operation(key: str, operation: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        CACHE_REQUESTS.labels(prefix(key), "error").inc()
+        raise
+    finally:
+        CACHE_LATENCY.labels(prefix(key), operation).observe(
+                time.perf_counter() - started
+        )
+
+
+def tracked(method):
+
+    # Statements executed by the decorated CRUD method are labelled with
+    # its name, the method is expected to be wrapped by classmethod
+    @functools.wraps(method)
+    async def wrapper(cls, *args, **kwargs):
+        token = crud_method.set(f"{cls.__name__}.{method.__name__}")
+        try:
+            return await method(cls, *args, **kwargs)
+        finally:
+            crud_method.reset(token)
+
+    return wrapper
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    started = conn.info["query_started"].pop()
+    method = crud_method.get()
+    SQL_QUERIES.labels(method).inc()
+    SQL_LATENCY.labels(method).observe(time.perf_counter() - started)
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+
+    # A failed statement has no after_cursor_execute, its start is taken
+    # off the stack here, or the connection would keep it when pooled
+    if context.connection is None or context.execution_context is None:
+        return
+    stack = context.connection.info.get("query_started")
+    if stack:
+        stack.pop()
+
+
+class RouteMetrics():
+
+    # Plain ASGI middleware, it sees every message sent: a request is
+    # timed until the last message of its body, so streamed responses
+    # are timed whole, and a request that raised counts as a 500
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        observed = False
+
+        def observe():
+            nonlocal observed
+            observed = True
+
+            # Route template keeps the number of label values bounded
+            route = scope.get("route")
+            route = route.path if route else "unmatched"
+            REQUEST_LATENCY.labels(scope["method"], route).observe(
+                    time.perf_counter() - started
+            )
+            REQUESTS.labels(scope["method"], route, status).inc()
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if (
+                    message["type"] == "http.response.body"
+                    and not message.get("more_body", False)
+            ):
+                observe()
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            if not observed:
+                observe()
+
+
+class PoolCollector():
+
+    # Gauges are read from the pool at scrape time, through the stats
+    # function of the app's database module. It is registered by the app,
+    # so importing this module does not create an engine.
+    def __init__(self, stats: typing.Callable[[], dict]):
+        self.stats = stats
+
+    def collect(self):
+        stats = self.stats()
+        for name in ("size", "checked_in", "checked_out", "overflow"):
+            if name in stats:
+                yield GaugeMetricFamily(
+                        f"db_pool_{name}",
+                        f"Connection pool {name.replace('_', ' ')}",
+                        value=stats[name],
+                )
+        yield GaugeMetricFamily(
+                "db_pool_checkouts",
+                "Connections checked out since start",
+                value=stats["checkouts"],
+        )
+        yield GaugeMetricFamily(
+                "db_pool_wait_max_seconds",
+                "Longest wait for a free connection",
+                value=stats["waits"]["max_ms"] / 1000,
+        )
@@ -1,6 +1,7 @@
 from typing import Optional
 from typing import TYPE_CHECKING
 
+from sqlalchemy import Index
 from sqlmodel import Field
 from sqlmodel import Relationship
 from sqlmodel import SQLModel
@@ -30,7 +31,8 @@ class DishBase(SQLModel):
 
 class Dish(DishBase, table=True):
 
-    # Main table model for Dish
+    # Main table model for Dish, pages of a list are read in id order
+    __table_args__ = (Index("ix_dish_submenu_id_id", "submenu_id", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     submenu: Optional["Submenu"] = Relationship(back_populates="dishes")
 
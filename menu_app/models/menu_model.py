@@ -6,6 +6,8 @@ from sqlmodel import Field
 from sqlmodel import Relationship
 from sqlmodel import SQLModel
 
+from menu_app.models.submenu_model import SubmenuTree
+
 if TYPE_CHECKING:
     from menu_app.submenu_model import Submenu
 
@@ -15,16 +17,12 @@ class MenuBase(SQLModel):
     # Base model for Menu
     title: str
     description: str
-    submenus_count: Optional[int] = None
-    dishes_count: Optional[int] = None
 
     class Config:
         schema_extra = {
             "example": {
                 "title": "Menu 1",
                 "description": "Menu description 1",
-                "submenus_count": "3",
-                "dishes_count": "7"
                 }
         }
 
@@ -33,14 +31,33 @@ class Menu(MenuBase, table=True):
 
     # Main table model for Menu
     id: Optional[int] = Field(default=None, primary_key=True)
+
+    # Counters are maintained by menu_app.counters on submenu/dish writes
+    submenus_count: int = Field(
+            default=0,
+            sa_column_kwargs={"server_default": "0"},
+    )
+    dishes_count: int = Field(
+            default=0,
+            sa_column_kwargs={"server_default": "0"},
+    )
     submenus: List["Submenu"] = Relationship(
-            sa_relationship_kwargs={"cascade": "delete"},
+            sa_relationship_kwargs={
+                "cascade": "delete",
+                "order_by": "Submenu.id",
+            },
             back_populates="menu",
     )
 
 
 class MenuRead(MenuBase):
     id: str
+    submenus_count: int = 0
+    dishes_count: int = 0
+
+
+class MenuTree(MenuRead):
+    submenus: List[SubmenuTree] = []
 
 
 class MenuCreate(MenuBase):
@@ -0,0 +1,16 @@
+from typing import Generic
+from typing import List
+from typing import Optional
+from typing import TypeVar
+
+from pydantic.generics import GenericModel
+
+T = TypeVar("T")
+
+
+class Page(GenericModel, Generic[T]):
+
+    # Page of a list, "next" is the cursor of the following page or None
+    # when this page is the last one
+    items: List[T]
+    next: Optional[str] = None
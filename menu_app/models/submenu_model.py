@@ -2,10 +2,13 @@ from typing import List
 from typing import Optional
 from typing import TYPE_CHECKING
 
+from sqlalchemy import Index
 from sqlmodel import Field
 from sqlmodel import Relationship
 from sqlmodel import SQLModel
 
+from menu_app.models.dish_model import DishRead
+
 if TYPE_CHECKING:
     from menu_app.menu_model import Menu
     from menu_app.dish_model import Dish
@@ -17,7 +20,6 @@ class SubmenuBase(SQLModel):
     title: str = Field(index=True)
     description: str
     menu_id: Optional[int] = Field(default=None, foreign_key="menu.id")
-    dishes_count: Optional[int] = None
 
     class Config:
         schema_extra = {
@@ -25,18 +27,27 @@ class SubmenuBase(SQLModel):
                 "title": "Submenu 1",
                 "description": "Submenu description 1",
                 "menu_id": "1",
-                "dishes_count": "3"
                 }
         }
 
 
 class Submenu(SubmenuBase, table=True):
 
-    # Main table model for Submenu
+    # Main table model for Submenu, pages of a list are read in id order
+    __table_args__ = (Index("ix_submenu_menu_id_id", "menu_id", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
+
+    # Counter is maintained by menu_app.counters on dish writes
+    dishes_count: int = Field(
+            default=0,
+            sa_column_kwargs={"server_default": "0"},
+    )
     menu: Optional["Menu"] = Relationship(back_populates="submenus")
     dishes: List["Dish"] = Relationship(
-            sa_relationship_kwargs={"cascade": "delete"},
+            sa_relationship_kwargs={
+                "cascade": "delete",
+                "order_by": "Dish.id",
+            },
             back_populates="submenu",
     )
 
@@ -47,6 +58,11 @@ class SubmenuCreate(SubmenuBase):
 
 class SubmenuRead(SubmenuBase):
     id: str
+    dishes_count: int = 0
+
+
+class SubmenuTree(SubmenuRead):
+    dishes: List[DishRead] = []
 
 
 class SubmenuUpdate(SQLModel):
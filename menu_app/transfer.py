@@ -0,0 +1,337 @@
+"""Streaming import and export of whole menus.
+
+Records are menus, submenus and dishes, one per line, parents before
+their children, as JSON Lines:
+
+    {"type": "menu", "id": 1, "title": "Menu 1", "description": "..."}
+    {"type": "submenu", "id": 1, "menu_id": 1, "title": ..., ...}
+    {"type": "dish", "id": 1, "submenu_id": 1, "price": 9.99, ...}
+
+or as CSV with a header line and the columns of FIELDS. Export streams
+rows from server-side cursors, import parses the body line by line and
+writes records in chunks (COPY on asyncpg), so neither holds more than
+a chunk in memory. Ids are kept, an import restores the exported rows.
+"""
+import codecs
+import collections
+import csv
+import io
+import typing
+
+import orjson
+from asyncpg.exceptions import IntegrityConstraintViolationError
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from menu_app import counters
+from menu_app.cache import Cache
+from menu_app.models.dish_model import Dish
+from menu_app.models.dish_model import DishCreate
+from menu_app.models.menu_model import Menu
+from menu_app.models.menu_model import MenuCreate
+from menu_app.models.submenu_model import Submenu
+from menu_app.models.submenu_model import SubmenuCreate
+
+FIELDS = (
+    "type", "id", "menu_id", "submenu_id", "title", "description", "price",
+)
+
+# Record type: table model, create schema to validate records with
+TYPES = {
+    "menu": (Menu, MenuCreate),
+    "submenu": (Submenu, SubmenuCreate),
+    "dish": (Dish, DishCreate),
+}
+
+CHUNK_SIZE = 1000
+
+
+def record(type: str, row) -> dict:
+    _, schema = TYPES[type]
+    data = {"type": type, "id": row.id}
+    data.update(
+            (field, getattr(row, field)) for field in schema.__fields__
+    )
+
+    return data
+
+
+def dump(data: dict, format: str) -> bytes:
+    if format == "csv":
+        line = io.StringIO()
+        csv.writer(line).writerow([data.get(field) for field in FIELDS])
+        return line.getvalue().encode()
+
+    return orjson.dumps(data) + b"\n"
+
+
+async def export(db: AsyncSession, format: str = "jsonl"):
+    if format == "csv":
+        yield dump(dict(zip(FIELDS, FIELDS)), format)
+
+    for type, (model, _) in TYPES.items():
+        result = await db.stream_scalars(
+                select(model).order_by(model.id).execution_options(
+                    yield_per=CHUNK_SIZE
+                )
+        )
+        async for rows in result.partitions(CHUNK_SIZE):
+            yield b"".join(dump(record(type, row), format) for row in rows)
+
+
+class Pending(collections.deque):
+
+    # Lines waiting for the CSV reader, which can read on after they ran
+    # out, when more are appended
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self:
+            raise StopIteration
+        return self.popleft()
+
+
+async def lines(chunks: typing.AsyncIterator[bytes]):
+
+    # Body is split into lines as it arrives, whatever the chunk sizes
+    rest = b""
+    async for chunk in chunks:
+        rest += chunk
+        *complete, rest = rest.split(b"\n")
+        for line in complete:
+            yield line
+    yield rest
+
+
+async def text_lines(chunks: typing.AsyncIterator[bytes]):
+
+    # Body decoded as it arrives, characters may be split between chunks.
+    # Lines keep their ends, which belong to the quoted fields they are in.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    rest = ""
+    async for chunk in chunks:
+        rest += decoder.decode(chunk)
+        *complete, rest = rest.split("\n")
+        for line in complete:
+            yield line + "\n"
+    rest += decoder.decode(b"", final=True)
+    if rest:
+        yield rest
+
+
+async def objects(chunks: typing.AsyncIterator[bytes]):
+    async for line in lines(chunks):
+        if line.strip():
+            data = orjson.loads(line)
+            if not isinstance(data, dict):
+                raise TypeError("record is not an object")
+            yield data
+
+
+async def fields(chunks: typing.AsyncIterator[bytes]):
+
+    # One reader parses the whole body. Quoted fields may span lines, so
+    # lines are passed on a record at a time, once their quotes are
+    # balanced, and the reader never runs out in the middle of a record.
+    pending = Pending()
+    reader = csv.reader(pending)
+    header = None
+    record = list()
+    quotes = 0
+    async for line in text_lines(chunks):
+        record.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        pending.extend(record)
+        record.clear()
+        quotes = 0
+        values = next(reader, None)
+        if not values:
+            continue
+        if header is None:
+            header = values
+            continue
+        yield {
+            field: value
+            for field, value in zip(header, values) if value != ""
+        }
+    if record:
+        raise csv.Error("unterminated quoted field")
+
+
+async def records(chunks: typing.AsyncIterator[bytes], format: str):
+    rows = fields(chunks) if format == "csv" else objects(chunks)
+    number = 0
+    while True:
+        number += 1
+        try:
+            data = await anext(rows, None)
+            if data is None:
+                return
+            model, schema = TYPES[data.pop("type")]
+            row = schema.parse_obj(data).dict()
+            row["id"] = int(data["id"])
+        except (
+                KeyError, TypeError, ValueError, ValidationError, csv.Error,
+        ):
+            raise HTTPException(
+                    status_code=422,
+                    detail=f"invalid record {number}",
+            )
+        yield number, model, row
+
+
+async def write(db: AsyncSession, model, rows: list):
+    if not rows:
+        return
+
+    # COPY is the fastest way into Postgres, other databases get
+    # one executemany per chunk
+    table = model.__table__
+    if db.bind.dialect.driver == "asyncpg":
+        connection = await db.connection()
+
+        # COPY goes to the driver's connection, whose transaction is only
+        # begun by a statement run through SQLAlchemy: without one, every
+        # chunk would be committed on its own and outlive a rollback
+        await connection.exec_driver_sql("SELECT 1")
+        raw = await connection.get_raw_connection()
+        columns = list(rows[0])
+        try:
+            await raw.connection.driver_connection.copy_records_to_table(
+                    table.name,
+                    records=[tuple(row[column] for column in columns)
+                             for row in rows],
+                    columns=columns,
+            )
+        except IntegrityConstraintViolationError as error:
+
+            # COPY goes around SQLAlchemy, which wraps the other drivers
+            raise IntegrityError("COPY", None, error) from error
+    else:
+        await db.execute(insert(table), rows)
+    rows.clear()
+
+
+async def sequences(db: AsyncSession):
+
+    # Moves id sequences past the ids of rows inserted with their ids,
+    # only Postgres has them
+    if db.bind.dialect.name != "postgresql":
+        return
+
+    for model, _ in TYPES.values():
+        await db.execute(
+                select(func.setval(
+                    func.pg_get_serial_sequence(model.__tablename__, "id"),
+                    func.coalesce(func.max(model.id), 1),
+                ))
+        )
+
+
+async def conflict(
+        db: AsyncSession,
+        model,
+        rows: list,
+        numbers: list,
+) -> HTTPException:
+
+    # Names the first record of a rejected chunk whose id is taken, by
+    # rows from before the import (which was rolled back) or by a record
+    # of the same chunk. Otherwise it clashes with an earlier chunk or
+    # lacks its parent, and only the chunk can be named.
+    ids = [row["id"] for row in rows]
+    result = await db.execute(select(model.id).where(model.id.in_(ids)))
+    existing = set(result.scalars().all())
+    seen = set()
+    for number, id in zip(numbers, ids):
+        if id in existing or id in seen:
+            return HTTPException(
+                    status_code=409,
+                    detail=f"record {number}: {model.__tablename__} {id} "
+                           f"already exists",
+            )
+        seen.add(id)
+
+    return HTTPException(
+            status_code=409,
+            detail=f"records {numbers[0]} to {numbers[-1]}: a "
+                   f"{model.__tablename__} id is repeated or a parent is "
+                   f"missing",
+    )
+
+
+async def load(
+        db: AsyncSession,
+        chunks: typing.AsyncIterator[bytes],
+        format: str = "jsonl",
+) -> dict:
+    buffers = {model: list() for model, _ in TYPES.values()}
+    numbers = {model: list() for model, _ in TYPES.values()}
+    imported = {type: 0 for type in TYPES}
+    menu_ids = set()
+    submenu_ids = set()
+
+    async def flush():
+
+        # All buffers are written together, parents first, so that
+        # children never reach the database before their parents
+        for buffered, rows in buffers.items():
+            try:
+                await write(db, buffered, rows)
+            except IntegrityError:
+                await db.rollback()
+                raise await conflict(db, buffered, rows, numbers[buffered])
+            numbers[buffered].clear()
+
+    # The import is one transaction: an invalid record or a conflict
+    # anywhere in the body leaves none of its rows behind
+    try:
+        async for number, model, row in records(chunks, format):
+            buffers[model].append(row)
+            numbers[model].append(number)
+            imported[model.__tablename__] += 1
+            if model is Menu:
+                menu_ids.add(row["id"])
+            elif model is Submenu:
+                menu_ids.add(row["menu_id"])
+            else:
+                submenu_ids.add(row["submenu_id"])
+            if len(buffers[model]) >= CHUNK_SIZE:
+                await flush()
+        await flush()
+    except Exception:
+        await db.rollback()
+        raise
+
+    # Rows were inserted with their ids, sequences have to catch up
+    await sequences(db)
+
+    ids = list(submenu_ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        result = await db.execute(
+                select(Submenu.menu_id).where(
+                    Submenu.id.in_(ids[start:start + CHUNK_SIZE])
+                ).distinct()
+        )
+        menu_ids.update(result.scalars().all())
+
+    # Imported rows bypass the mapper events: counters of the menus that
+    # got rows are recounted (which commits) and the menus purged
+    menu_ids.discard(None)
+    await counters.reconcile(db, menu_ids)
+    await Cache.invalidate_many(
+            keys=[
+                *(f"menu:{menu_id}" for menu_id in menu_ids), "menus", "tree",
+            ],
+            namespaces=[f"menu:{menu_id}" for menu_id in menu_ids],
+    )
+
+    return imported
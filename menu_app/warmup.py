@@ -0,0 +1,179 @@
+"""Cache warm-up after deploys and invalidation storms.
+
+Preloads the menu list, every menu, submenu list, submenu and dish list
+into cache through the regular CRUD reads. Keys still in cache, checked
+with one MGET per chunk, are skipped.
+Runs in background on startup with CACHE_WARM=1, on
+POST /api/v1/cache/warm after invalidation storms, or from the shell:
+
+    python -m menu_app.warmup --concurrency 8
+
+Until it finishes /api/v1/ready reports "warming", and "failed" with
+the error if it does not complete.
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+from fastapi import HTTPException
+from sqlmodel import select
+
+from menu_app.cache import Cache
+from menu_app.crud.crud_dish import DishCrud
+from menu_app.crud.crud_menu import MenuCrud
+from menu_app.crud.crud_submenu import SubmenuCrud
+from menu_app.database import async_engine
+from menu_app.database import async_session
+from menu_app.models.dish_model import Dish
+from menu_app.models.menu_model import Menu
+from menu_app.models.submenu_model import Submenu
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = int(os.environ.get("CACHE_WARM_CONCURRENCY", 8))
+CHUNK_SIZE = 1000
+
+state = {
+    "status": "idle", "done": 0, "total": 0, "seconds": None, "error": None,
+}
+
+# Running warm-ups, referenced until they are done
+tasks = set()
+
+
+async def jobs() -> list:
+
+    # Reads to run, as (key, CRUD method, arguments after the session)
+    async with async_session() as db:
+        menus = (await db.execute(select(Menu.id))).scalars().all()
+        submenus = (await db.execute(
+                select(Submenu.id, Submenu.menu_id)
+        )).all()
+
+    return [
+        (MenuCrud.list_key(Menu), MenuCrud.get_list, (Menu,)),
+        *(
+            (MenuCrud.key(Menu, menu_id), MenuCrud.get, (Menu, menu_id))
+            for menu_id in menus
+        ),
+        *(
+            (
+                SubmenuCrud.list_key(Submenu, menu_id),
+                SubmenuCrud.get_list,
+                (Submenu, menu_id),
+            )
+            for menu_id in menus
+        ),
+        *(
+            (
+                SubmenuCrud.key(Submenu, submenu_id, menu_id),
+                SubmenuCrud.get,
+                (Submenu, submenu_id, menu_id),
+            )
+            for submenu_id, menu_id in submenus
+        ),
+        *(
+            (
+                DishCrud.list_key(Dish, menu_id, submenu_id),
+                DishCrud.get_list,
+                (Dish, menu_id, submenu_id),
+            )
+            for submenu_id, menu_id in submenus
+        ),
+    ]
+
+
+async def missing(chunk: list) -> list:
+
+    # Jobs of keys which are not in cache, looked up with one MGET
+    bodies = await Cache.get_many(*(key for key, _, _ in chunk))
+    state["done"] += sum(body is not None for body in bodies)
+
+    return [job for job, body in zip(chunk, bodies) if body is None]
+
+
+async def warm(concurrency: int = CONCURRENCY) -> dict:
+    started = time.perf_counter()
+    state.update(status="warming", done=0, total=0, seconds=None, error=None)
+    try:
+        pending = await jobs()
+        state["total"] = len(pending)
+        logger.info("Cache warm-up: %d keys", state["total"])
+
+        async def worker(pending):
+            for _, method, args in pending:
+                async with async_session() as db:
+
+                    # Entities deleted meanwhile are skipped
+                    with contextlib.suppress(HTTPException):
+                        await method(db, *args)
+                state["done"] += 1
+                if state["done"] % 1000 == 0:
+                    logger.info(
+                            "Cache warm-up: %d/%d keys",
+                            state["done"], state["total"],
+                    )
+
+        # Workers of a chunk share one iterator, so at most `concurrency`
+        # reads (and connections) are in flight at a time
+        for start in range(0, len(pending), CHUNK_SIZE):
+            chunk = iter(await missing(pending[start:start + CHUNK_SIZE]))
+            await asyncio.gather(
+                    *(worker(chunk) for _ in range(concurrency))
+            )
+    except BaseException as error:
+
+        # Cancellations too, or the status would stay "warming"
+        state.update(
+                status="failed",
+                error=str(error) or type(error).__name__,
+                seconds=round(time.perf_counter() - started, 3),
+        )
+        logger.exception("Cache warm-up failed after %d keys", state["done"])
+        raise
+    state.update(
+            status="ready",
+            seconds=round(time.perf_counter() - started, 3),
+    )
+    logger.info(
+            "Cache warm-up: %d keys in %.2f s", state["done"], state["seconds"]
+    )
+
+    return dict(state)
+
+
+def start() -> asyncio.Task | None:
+
+    # Warm-up is run once at a time, in background of the app
+    if state["status"] == "warming":
+        return None
+
+    state["status"] = "warming"
+    task = asyncio.create_task(warm())
+    tasks.add(task)
+    task.add_done_callback(finished)
+
+    return task
+
+
+def finished(task: asyncio.Task):
+    tasks.discard(task)
+
+    # Retrieved here, or asyncio would only report it at exit
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Cache warm-up task failed: %r", task.exception())
+
+
+async def main(args):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    await warm(args.concurrency)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,29 @@
+"""drop stored counts
+
+Revision ID: 5d0f2e8a9c41
+Revises: bca3681cfa76
+Create Date: 2026-10-18 10:12:37.418204
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5d0f2e8a9c41'
+down_revision = 'bca3681cfa76'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Counts are computed by read queries, stored copies were never read
+    op.drop_column('submenu', 'dishes_count')
+    op.drop_column('menu', 'dishes_count')
+    op.drop_column('menu', 'submenus_count')
+
+
+def downgrade() -> None:
+    op.add_column('menu', sa.Column('submenus_count', sa.Integer(), nullable=True))
+    op.add_column('menu', sa.Column('dishes_count', sa.Integer(), nullable=True))
+    op.add_column('submenu', sa.Column('dishes_count', sa.Integer(), nullable=True))
@@ -0,0 +1,42 @@
+"""maintained counters
+
+Revision ID: 8e3b71c4d2a6
+Revises: 5d0f2e8a9c41
+Create Date: 2026-10-18 11:40:02.551093
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8e3b71c4d2a6'
+down_revision = '5d0f2e8a9c41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('menu', sa.Column('submenus_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('menu', sa.Column('dishes_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('submenu', sa.Column('dishes_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill, afterwards counters are maintained on every write
+    op.execute(
+        "UPDATE submenu SET dishes_count = ("
+        "SELECT count(*) FROM dish WHERE dish.submenu_id = submenu.id)"
+    )
+    op.execute(
+        "UPDATE menu SET "
+        "submenus_count = ("
+        "SELECT count(*) FROM submenu WHERE submenu.menu_id = menu.id), "
+        "dishes_count = ("
+        "SELECT coalesce(sum(submenu.dishes_count), 0) FROM submenu "
+        "WHERE submenu.menu_id = menu.id)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('submenu', 'dishes_count')
+    op.drop_column('menu', 'dishes_count')
+    op.drop_column('menu', 'submenus_count')
@@ -0,0 +1,25 @@
+"""list order indexes
+
+Revision ID: c7a4e19d3b58
+Revises: 8e3b71c4d2a6
+Create Date: 2026-10-18 14:05:37.310482
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a4e19d3b58'
+down_revision = '8e3b71c4d2a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_submenu_menu_id_id', 'submenu', ['menu_id', 'id'], unique=False)
+    op.create_index('ix_dish_submenu_id_id', 'dish', ['submenu_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_dish_submenu_id_id', table_name='dish')
+    op.drop_index('ix_submenu_menu_id_id', table_name='submenu')
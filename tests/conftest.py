@@ -2,12 +2,12 @@ import asyncio
 import os
 
 import pytest_asyncio
-from aioredis import from_url
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import SQLModel
 
+from menu_app.cache import Cache
 from menu_app.database import get_session
 from menu_app.main import app
 
@@ -81,8 +81,4 @@ async def cache():
 
     yield
 
-    cache = from_url(
-            os.environ.get('CACHE_URL'),
-            encoding='latin-1',
-            decode_responses=False)
-    await cache.flushdb(asynchronous=True)
+    await Cache.backend.flush()
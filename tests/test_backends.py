@@ -0,0 +1,140 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+from menu_app import cache_backends
+from menu_app.cache_backends import MemoryBackend
+from menu_app.cache_backends import NullBackend
+from menu_app.cache_backends import RedisBackend
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_from_env(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.delenv("CACHE_BACKEND", raising=False)
+    monkeypatch.setenv("CACHE_URL", "redis://nowhere")
+
+    backend = cache_backends.from_env()
+
+    # Nothing is connected before the first command
+    assert isinstance(backend, RedisBackend)
+    assert backend._client is None
+
+    monkeypatch.delenv("CACHE_URL")
+
+    # Memory is never chosen for a missing URL, only on request
+    with pytest.raises(ValueError):
+        cache_backends.from_env()
+
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+
+    assert isinstance(cache_backends.from_env(), MemoryBackend)
+
+    monkeypatch.setenv("CACHE_BACKEND", "null")
+
+    assert isinstance(cache_backends.from_env(), NullBackend)
+
+    monkeypatch.setenv("CACHE_BACKEND", "memcached")
+
+    with pytest.raises(ValueError):
+        cache_backends.from_env()
+
+
+async def test_backend_chosen_on_first_use():
+    env = {
+        name: value for name, value in os.environ.items()
+        if name not in ("CACHE_URL", "CACHE_BACKEND", "DATABASE_URL")
+    }
+
+    def run(code: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+                [sys.executable, "-c", code],
+                env=env,
+                capture_output=True,
+                text=True,
+        )
+
+    # Imports need no settings, the missing URL is reported on first use
+    assert run("import menu_app.cache").returncode == 0
+
+    result = run("from menu_app.cache import Cache; Cache.local")
+
+    assert result.returncode == 1
+    assert "ValueError: CACHE_URL is not set" in result.stderr
+
+
+async def test_memory_backend_lru_and_ttl():
+    backend = MemoryBackend(2)
+    await backend.incr("gen:menu:1")
+    await backend.set_many([("a", b"1", None), ("b", b"2", 60000)])
+    await backend.get("a")
+    await backend.set("c", b"3")
+
+    # Counters are never evicted
+    assert await backend.get_many("a", "b", "c", "gen:menu:1") == [
+        b"1", None, b"3", b"1",
+    ]
+    assert await backend.pttl("a") == -1
+    assert await backend.pttl("b") == -2
+
+    await backend.expire("a", 1)
+    await asyncio.sleep(0.01)
+
+    assert await backend.get("a") is None
+
+
+async def test_memory_backend_locks_and_publish():
+    backend = MemoryBackend(10)
+
+    assert await backend.set("lock:menus", "token", nx=True, px=1000)
+    assert not await backend.set("lock:menus", "other", nx=True, px=1000)
+
+    await backend.unlock("lock:menus", "other")
+
+    assert await backend.exists("lock:menus")
+
+    await backend.unlock("lock:menus", "token")
+
+    assert not await backend.exists("lock:menus")
+
+    messages = backend.subscribe("channel")
+    message = asyncio.ensure_future(messages.__anext__())
+    await asyncio.sleep(0)
+    await backend.incr("ver:menus", channel="channel", message="ver:menus")
+
+    assert await message == "ver:menus"
+    assert await backend.get("ver:menus") == b"1"
+
+    await messages.aclose()
+
+
+async def test_null_backend():
+    backend = NullBackend()
+    await backend.set_many([("a", b"1", None)])
+    await backend.incr("ver:a")
+
+    assert await backend.get_many("a", "ver:a") == [None, None]
+    assert await backend.set("lock:a", "token", nx=True)
+    assert await backend.set("lock:a", "token", nx=True)
+
+
+async def test_memory_backend_counter_ttl():
+    backend = MemoryBackend(10)
+    await backend.incr("ver:a", "ver:b", px=20)
+    await backend.set_many([("a#1", b"1", None)], ["ver:a", "ver:c"], 60000)
+
+    assert await backend.pttl("ver:a") > 20
+    assert await backend.get("ver:c") is None
+
+    await asyncio.sleep(0.03)
+
+    # Expired counters start again from zero
+    assert await backend.get_many("ver:a", "ver:b") == [b"1", None]
+
+    await backend.incr("ver:b")
+
+    assert await backend.get("ver:b") == b"1"
@@ -0,0 +1,677 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from menu_app.cache import Cache
+from menu_app.cache import LocalCache
+from menu_app.cache import MISSING
+from menu_app.crud.crud_base import Crud_Base
+from menu_app.models.dish_model import Dish
+from menu_app.models.menu_model import Menu
+from menu_app.models.submenu_model import Submenu
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def cached(*keys: str) -> int:
+
+    # Number of keys present in cache
+    return sum([await Cache.get_data(key) is not None for key in keys])
+
+
+async def test_submenu_lists_are_scoped_by_menu(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu_1 = Menu(title="Menu 1", description="Menu description 1")
+    menu_2 = Menu(title="Menu 2", description="Menu description 2")
+    async_session.add(menu_1)
+    async_session.add(menu_2)
+    await async_session.commit()
+    async_session.add(Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu_1.id
+    ))
+    await async_session.commit()
+
+    response = await async_client.get(f"menus/{menu_1.id}/submenus")
+
+    assert len(response.json()) == 1
+
+    response = await async_client.get(f"menus/{menu_2.id}/submenus")
+
+    assert response.json() == []
+
+
+async def test_create_invalidates_only_affected_parent(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu_1 = Menu(title="Menu 1", description="Menu description 1")
+    menu_2 = Menu(title="Menu 2", description="Menu description 2")
+    async_session.add(menu_1)
+    async_session.add(menu_2)
+    await async_session.commit()
+    submenu_1 = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu_1.id
+    )
+    submenu_2 = Submenu(
+            title="Submenu 2",
+            description="Submenu description 2",
+            menu_id=menu_2.id
+    )
+    async_session.add(submenu_1)
+    async_session.add(submenu_2)
+    await async_session.commit()
+
+    for menu, submenu in ((menu_1, submenu_1), (menu_2, submenu_2)):
+        await async_client.get(f"menus/{menu.id}")
+        await async_client.get(f"menus/{menu.id}/submenus")
+        await async_client.get(f"menus/{menu.id}/submenus/{submenu.id}")
+        await async_client.get(
+                f"menus/{menu.id}/submenus/{submenu.id}/dishes"
+        )
+
+    response = await async_client.post(
+            f"menus/{menu_1.id}/submenus/{submenu_1.id}/dishes",
+            json={"title": "Dish", "description": "Dish", "price": 1.5},
+    )
+
+    assert response.status_code == 201
+    assert not await cached(
+            f"menu:{menu_1.id}",
+            f"menu:{menu_1.id}/submenus",
+            f"menu:{menu_1.id}/submenu:{submenu_1.id}",
+            f"menu:{menu_1.id}/submenu:{submenu_1.id}/dishes",
+    )
+    assert await cached(
+            f"menu:{menu_2.id}",
+            f"menu:{menu_2.id}/submenus",
+            f"menu:{menu_2.id}/submenu:{submenu_2.id}",
+            f"menu:{menu_2.id}/submenu:{submenu_2.id}/dishes",
+    ) == 4
+
+    response = await async_client.get(f"menus/{menu_1.id}")
+
+    assert response.json()["dishes_count"] == 1
+
+    response = await async_client.get(f"menus/{menu_1.id}/submenus")
+
+    assert response.json()[0]["dishes_count"] == 1
+
+
+async def test_delete_invalidates_only_deleted_subtree(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu_1 = Menu(title="Menu 1", description="Menu description 1")
+    menu_2 = Menu(title="Menu 2", description="Menu description 2")
+    async_session.add(menu_1)
+    async_session.add(menu_2)
+    await async_session.commit()
+    submenu_1 = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu_1.id
+    )
+    submenu_2 = Submenu(
+            title="Submenu 2",
+            description="Submenu description 2",
+            menu_id=menu_2.id
+    )
+    async_session.add(submenu_1)
+    async_session.add(submenu_2)
+    await async_session.commit()
+    dish_1 = Dish(
+        title="Dish 1",
+        description="Dish description 1",
+        price=99.99,
+        submenu_id=submenu_1.id,
+    )
+    dish_2 = Dish(
+        title="Dish 2",
+        description="Dish description 2",
+        price=33.15,
+        submenu_id=submenu_2.id,
+    )
+    async_session.add(dish_1)
+    async_session.add(dish_2)
+    await async_session.commit()
+
+    for menu, submenu, dish in (
+            (menu_1, submenu_1, dish_1),
+            (menu_2, submenu_2, dish_2),
+    ):
+        await async_client.get(f"menus/{menu.id}")
+        await async_client.get(f"menus/{menu.id}/submenus/{submenu.id}")
+        await async_client.get(
+                f"menus/{menu.id}/submenus/{submenu.id}/dishes"
+        )
+        await async_client.get(
+                f"menus/{menu.id}/submenus/{submenu.id}/dishes/{dish.id}"
+        )
+
+    response = await async_client.delete(f"menus/{menu_1.id}")
+
+    assert response.status_code == 200
+    assert not await cached(
+            f"menu:{menu_1.id}",
+            f"menu:{menu_1.id}/submenu:{submenu_1.id}",
+            f"menu:{menu_1.id}/submenu:{submenu_1.id}/dishes",
+            f"menu:{menu_1.id}/submenu:{submenu_1.id}/dish:{dish_1.id}",
+    )
+    assert await cached(
+            f"menu:{menu_2.id}",
+            f"menu:{menu_2.id}/submenu:{submenu_2.id}",
+            f"menu:{menu_2.id}/submenu:{submenu_2.id}/dishes",
+            f"menu:{menu_2.id}/submenu:{submenu_2.id}/dish:{dish_2.id}",
+    ) == 4
+
+    response = await async_client.delete(
+            f"menus/{menu_2.id}/submenus/{submenu_2.id}/dishes/{dish_2.id}"
+    )
+
+    assert response.status_code == 200
+    assert not await cached(
+            f"menu:{menu_2.id}/submenu:{submenu_2.id}",
+            f"menu:{menu_2.id}/submenu:{submenu_2.id}/dishes",
+            f"menu:{menu_2.id}/submenu:{submenu_2.id}/dish:{dish_2.id}",
+    )
+
+    response = await async_client.get(
+            f"menus/{menu_2.id}/submenus/{submenu_2.id}"
+    )
+
+    assert response.json()["dishes_count"] == 0
+
+
+async def test_made_up_path_is_not_cached(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+
+    response = await async_client.get(f"menus/42/submenus/{submenu.id}")
+
+    assert response.status_code == 200
+    assert not await cached(f"menu:42/submenu:{submenu.id}")
+
+    response = await async_client.get(
+            f"menus/{menu.id}/submenus/{submenu.id}"
+    )
+
+    assert response.status_code == 200
+    assert await cached(f"menu:{menu.id}/submenu:{submenu.id}")
+
+
+async def test_purge_namespace():
+    await Cache.save("menu:1/submenu:2/dish:3", "dish 3")
+    await Cache.save("menu:1/submenus", "submenus of menu 1")
+    await Cache.save("menu:2/submenus", "submenus of menu 2")
+    await Cache.purge("submenu:2")
+
+    assert await Cache.get_data("menu:1/submenu:2/dish:3") is None
+    assert await Cache.get_data("menu:1/submenus") == "submenus of menu 1"
+
+    await Cache.purge("menu:1")
+
+    assert await Cache.get_data("menu:1/submenus") is None
+    assert await Cache.get_data("menu:2/submenus") == "submenus of menu 2"
+
+
+async def test_counters_outlive_entries(monkeypatch: pytest.MonkeyPatch):
+    assert Cache.counter_ttl > Cache.expiry("menu:1/submenus")
+
+    monkeypatch.setattr(Cache, "counter_ttl", 100000)
+    await Cache.clear("menu:1/submenus")
+    await Cache.purge("menu:1")
+
+    # Bumped counters get their TTL, and saves under them refresh it
+    assert 90000 < await Cache.backend.pttl("gen:menu:1") <= 100000
+
+    monkeypatch.setattr(Cache, "counter_ttl", 200000)
+    await Cache.save("menu:1/submenus", "submenus of menu 1")
+
+    for counter in ("gen:menu:1", "ver:menu:1/submenus"):
+        assert 190000 < await Cache.backend.pttl(counter) <= 200000
+
+
+async def test_get_many_and_save_many():
+    bodies = await Cache.save_many({
+        "menus": ["menu"],
+        "menu:1/submenus": ["submenu"],
+    })
+
+    assert bodies == [b'["menu"]', b'["submenu"]']
+    assert await Cache.get_many(
+            "menus", "menu:2", "menu:1/submenus"
+    ) == [b'["menu"]', None, b'["submenu"]']
+
+    await Cache.clear("menus")
+
+    assert await Cache.get_many("menus", "menu:1/submenus") == [
+        None, b'["submenu"]',
+    ]
+
+
+async def test_write_is_one_round_trip(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+        monkeypatch: pytest.MonkeyPatch,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    await async_client.get(f"menus/{menu.id}")
+
+    # Every call of a backend method is one round trip
+    round_trips = list()
+
+    def counted(method):
+        async def wrapper(*args, **kwargs):
+            round_trips.append(method.__name__)
+            return await method(*args, **kwargs)
+        return wrapper
+
+    for name in ("get_many", "get_with_ttl", "set", "set_many", "incr"):
+        monkeypatch.setattr(
+                Cache.backend, name, counted(getattr(Cache.backend, name))
+        )
+    response = await async_client.delete(f"menus/{menu.id}")
+
+    assert response.status_code == 200
+    assert round_trips == ["incr"]
+
+    monkeypatch.undo()
+
+    assert await Cache.get_data(f"menu:{menu.id}") is None
+
+
+@pytest_asyncio.fixture(name="local_cache")
+async def local_cache():
+    Cache.local = LocalCache(100, 60)
+
+    yield Cache.local
+
+    Cache.local = None
+
+
+async def test_local_cache_lru_and_ttl():
+    local = LocalCache(2, 60)
+    local.set("a", 1)
+    local.set("b", 2)
+    local.get("a")
+    local.set("c", 3)
+
+    assert local.get("a") == 1
+    assert local.get("b") is MISSING
+    assert local.get("c") == 3
+
+    local = LocalCache(2, 0)
+    local.set("a", 1)
+
+    assert local.get("a") is MISSING
+
+
+async def test_two_tier_hits(local_cache: LocalCache):
+    await Cache.save("menu:1/submenus", ["submenu"])
+    local_cache.clear()
+    stats = Cache.stats()
+
+    assert await Cache.get_data("menu:1/submenus") == ["submenu"]
+    assert await Cache.get_data("menu:1/submenus") == ["submenu"]
+    assert await Cache.get_data("menu:2/submenus") is None
+
+    hits = Cache.stats()
+
+    assert hits["l1"]["hits"] - stats["l1"]["hits"] == 1
+    assert hits["l1"]["misses"] - stats["l1"]["misses"] == 2
+    assert hits["l2"]["hits"] - stats["l2"]["hits"] == 1
+    assert hits["l2"]["misses"] - stats["l2"]["misses"] == 1
+
+
+async def test_invalidation_from_other_worker(local_cache: LocalCache):
+    listener = asyncio.create_task(Cache.listen())
+    await asyncio.sleep(0.1)
+    try:
+        await Cache.save("menus", ["menu"])
+        await Cache.get_data("menu:1/submenus")
+        key, = await Cache.resolve("menus")
+
+        assert local_cache.get(key)[0] == b'["menu"]'
+        assert local_cache.get("gen:menu:1") == 0
+
+        # Another worker bumps the version and the generation
+        await Cache.backend.incr("ver:menus")
+        await Cache.backend.incr("gen:menu:1")
+        await Cache.backend.publish(Cache.channel, "ver:menus\ngen:menu:1")
+        await asyncio.sleep(0.1)
+
+        assert local_cache.get("ver:menus") is MISSING
+        assert local_cache.get("gen:menu:1") is MISSING
+        assert await Cache.get_data("menus") is None
+    finally:
+        listener.cancel()
+
+
+async def test_cached_payload_is_versioned_read_schema(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+
+    await async_client.get(f"menus/{menu.id}")
+    key, = await Cache.resolve(f"menu:{menu.id}")
+    data = await Cache.backend.get(key)
+
+    assert data.startswith(Cache.version)
+    assert Cache.decode(data) == {
+        "title": "Menu 1",
+        "description": "Menu description 1",
+        "id": str(menu.id),
+        "submenus_count": 0,
+        "dishes_count": 0,
+    }
+
+    # Entries of another schema version are misses
+    await Cache.backend.set(key, b"v0:" + data[3:])
+
+    assert await Cache.get_data(f"menu:{menu.id}") is None
+
+
+async def test_cache_hit_sends_cached_body(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Меню 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+    async_session.add(Dish(
+        title="Dish 1",
+        description="Dish description 1",
+        price=99.99,
+        submenu_id=submenu.id,
+    ))
+    await async_session.commit()
+
+    for url in (
+            "menus",
+            f"menus/{menu.id}",
+            f"menus/{menu.id}/submenus",
+            f"menus/{menu.id}/submenus/{submenu.id}",
+            f"menus/{menu.id}/submenus/{submenu.id}/dishes",
+    ):
+        miss = await async_client.get(url)
+        hit = await async_client.get(url)
+
+        assert hit.status_code == miss.status_code == 200
+        assert hit.headers["content-type"] == "application/json"
+        assert hit.content == miss.content
+
+
+async def test_etag_not_modified(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+
+    for url in ("menus", f"menus/{menu.id}"):
+        response = await async_client.get(url)
+        etag = response.headers["etag"]
+
+        response = await async_client.get(
+                url, headers={"If-None-Match": etag}
+        )
+
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+        response = await async_client.get(
+                url, headers={"If-None-Match": f'"other", W/{etag}'}
+        )
+
+        assert response.status_code == 304
+
+
+async def test_etag_changes_after_writes(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+
+    async def etags():
+        return [
+            (await async_client.get(url)).headers["etag"]
+            for url in ("menus", f"menus/{menu.id}")
+        ]
+
+    before = await etags()
+    await async_client.patch(
+            f"menus/{menu.id}",
+            json={"title": "Menu 2", "description": "Menu description 2"},
+    )
+    after_update = await etags()
+    await async_client.post(
+            f"menus/{menu.id}/submenus",
+            json={"title": "Submenu 1", "description": "Submenu 1"},
+    )
+    after_create = await etags()
+
+    assert before[0] != after_update[0] != after_create[0]
+    assert before[1] != after_update[1] != after_create[1]
+
+    response = await async_client.get(
+            f"menus/{menu.id}", headers={"If-None-Match": before[1]}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["title"] == "Menu 2"
+
+    # Tags are hashes of the bodies, a reload of the same body keeps it
+    await Cache.purge(f"menu:{menu.id}")
+    etag = (await async_client.get(f"menus/{menu.id}/submenus")).headers
+    await Cache.purge(f"menu:{menu.id}")
+
+    assert etag["etag"] == (
+            await async_client.get(f"menus/{menu.id}/submenus")
+    ).headers["etag"]
+
+
+async def test_cache_hit_checks_out_no_connection(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    urls = ("menus", f"menus/{menu.id}", "menus/tree")
+    for url in urls:
+        await async_client.get(url)
+
+    # Reads left the session in a transaction holding its connection
+    await async_session.rollback()
+    checkouts = list()
+    event.listen(
+            async_session.bind.sync_engine,
+            "checkout",
+            lambda *args: checkouts.append(args),
+    )
+    for url in urls:
+        response = await async_client.get(url)
+        etag = response.headers["etag"]
+        await async_client.get(url, headers={"If-None-Match": etag})
+
+    assert checkouts == []
+
+
+async def test_concurrent_misses_load_once(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    for number in range(3):
+        async_session.add(Menu(title=f"Menu {number}", description="Menu"))
+    await async_session.commit()
+    statements = list()
+    event.listen(
+            async_session.bind.sync_engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args),
+    )
+
+    counts = list()
+    for concurrency in (1, 10, 50):
+        await Cache.clear("menus")
+        statements.clear()
+        responses = await asyncio.gather(*(
+            async_client.get("menus") for _ in range(concurrency)
+        ))
+
+        assert {len(response.json()) for response in responses} == {3}
+
+        counts.append(len(statements))
+
+    assert counts == [1, 1, 1]
+
+
+async def test_load_after_write_is_not_shared():
+    loading = asyncio.Event()
+    written = asyncio.Event()
+
+    async def before_write():
+        loading.set()
+        await written.wait()
+        return b'["pre-write"]'
+
+    async def after_write():
+        return b'["post-write"]'
+
+    stored, = await Cache.resolve("menus")
+    first = asyncio.create_task(
+            Cache.single_flight("menus", before_write, stored)
+    )
+    await loading.wait()
+
+    # A write bumps the version while the first load is in flight
+    await Cache.clear("menus")
+    stored, = await Cache.resolve("menus")
+    second = asyncio.create_task(
+            Cache.single_flight("menus", after_write, stored)
+    )
+    await asyncio.sleep(0.05)
+    written.set()
+
+    assert await first == b'["pre-write"]'
+    assert await second == b'["post-write"]'
+
+
+async def test_miss_waits_for_other_worker(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    statements = list()
+    event.listen(
+            async_session.bind.sync_engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args),
+    )
+
+    # Another worker holds the lock of the key and loads it
+    await Cache.backend.set("lock:menus", "other", px=Cache.lock_ttl)
+    stats = Cache.stats()
+    request = asyncio.create_task(async_client.get("menus"))
+    await asyncio.sleep(0.1)
+    await Cache.save("menus", ["menu"])
+    response = await request
+
+    assert response.json() == ["menu"]
+    assert statements == []
+
+    # The polls are not counted, the request is a single miss
+    after = Cache.stats()
+
+    assert after["l2"]["hits"] == stats["l2"]["hits"]
+    assert after["l2"]["misses"] - stats["l2"]["misses"] == 1
+
+
+async def test_ttl_per_prefix_with_jitter(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+        monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(Cache, "ttls", {"menu": 10})
+    monkeypatch.setattr(Cache, "jitter", 0.5)
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    await async_client.get("menus")
+    await async_client.get(f"menus/{menu.id}")
+
+    key, menus = await Cache.resolve(f"menu:{menu.id}", "menus")
+
+    assert 9000 < await Cache.backend.pttl(key) <= 15000
+    assert await Cache.backend.pttl(menus) > 15000
+
+
+async def test_stale_while_revalidate(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+        monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(Cache, "stale", 60)
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    await async_client.get(f"menus/{menu.id}")
+
+    # Write which missed its invalidation, and the entry gets past TTL
+    menu.title = "Menu 2"
+    await async_session.commit()
+    key, = await Cache.resolve(f"menu:{menu.id}")
+    await Cache.backend.expire(key, 1000)
+
+    response = await async_client.get(f"menus/{menu.id}")
+    etag = response.headers["etag"]
+
+    assert response.json()["title"] == "Menu 1"
+
+    await asyncio.gather(*Crud_Base.refreshes)
+    response = await async_client.get(
+            f"menus/{menu.id}", headers={"If-None-Match": etag}
+    )
+
+    # Reload saved another body under the same key, and another tag
+    assert response.status_code == 200
+    assert response.json()["title"] == "Menu 2"
+    assert response.headers["etag"] != etag
+    assert await Cache.backend.pttl(key) > 60000
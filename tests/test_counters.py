@@ -0,0 +1,176 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import event
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from menu_app.counters import reconcile
+from menu_app.models.dish_model import Dish
+from menu_app.models.menu_model import Menu
+from menu_app.models.submenu_model import Submenu
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_counters_cascade_delete(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+
+    response = await async_client.post(
+            f"menus/{menu.id}/submenus",
+            json={"title": "Submenu 1", "description": "Submenu 1"},
+    )
+    submenu_1 = response.json()["id"]
+    response = await async_client.post(
+            f"menus/{menu.id}/submenus",
+            json={"title": "Submenu 2", "description": "Submenu 2"},
+    )
+    submenu_2 = response.json()["id"]
+
+    for submenu_id in (submenu_1, submenu_1, submenu_2):
+        response = await async_client.post(
+                f"menus/{menu.id}/submenus/{submenu_id}/dishes",
+                json={"title": "Dish", "description": "Dish", "price": 1.5},
+        )
+        assert response.status_code == 201
+
+    response = await async_client.get(f"menus/{menu.id}")
+    data = response.json()
+
+    assert data["submenus_count"] == 2
+    assert data["dishes_count"] == 3
+
+    response = await async_client.delete(
+            f"menus/{menu.id}/submenus/{submenu_1}"
+    )
+
+    assert response.status_code == 200
+
+    response = await async_client.get(f"menus/{menu.id}")
+    data = response.json()
+
+    assert data["submenus_count"] == 1
+    assert data["dishes_count"] == 1
+
+
+async def test_reconcile(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+    async_session.add(Dish(
+        title="Dish 1",
+        description="Dish description 1",
+        price=9.99,
+        submenu_id=submenu.id,
+    ))
+    await async_session.commit()
+
+    # Drift the counters behind the ORM's back
+    await async_session.execute(
+            update(Menu).where(Menu.id == menu.id).values(dishes_count=42)
+    )
+    await async_session.execute(
+            update(Submenu).where(Submenu.id == submenu.id).values(
+                dishes_count=0
+            )
+    )
+    await async_session.commit()
+
+    assert await reconcile(async_session) == {"menus": 1, "submenus": 1}
+    assert await reconcile(async_session) == {"menus": 0, "submenus": 0}
+
+    response = await async_client.get(f"menus/{menu.id}")
+    data = response.json()
+
+    assert data["submenus_count"] == 1
+    assert data["dishes_count"] == 1
+
+    response = await async_client.get(
+            f"menus/{menu.id}/submenus/{submenu.id}"
+    )
+    data = response.json()
+
+    assert data["dishes_count"] == 1
+
+
+async def test_cascade_delete_statements(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenus = [
+        Submenu(title=f"Submenu {n}", description="", menu_id=menu.id)
+        for n in range(2)
+    ]
+    async_session.add_all(submenus)
+    await async_session.commit()
+    async_session.add_all([
+        Dish(title="Dish", description="", price=1.5, submenu_id=submenu.id)
+        for submenu in submenus for _ in range(3)
+    ])
+    await async_session.commit()
+
+    updates = list()
+
+    def executed(conn, cursor, statement, parameters, context, many):
+        if statement.startswith("UPDATE"):
+            updates.append(statement)
+
+    engine = async_session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", executed)
+    try:
+        response = await async_client.delete(
+                f"menus/{menu.id}/submenus/{submenus[0].id}"
+        )
+
+        # The menu is shifted once, not twice per cascaded dish
+        assert response.status_code == 200
+        assert len(updates) == 1
+
+        response = await async_client.get(f"menus/{menu.id}")
+
+        assert response.json()["submenus_count"] == 1
+        assert response.json()["dishes_count"] == 3
+
+        updates.clear()
+        response = await async_client.delete(f"menus/{menu.id}")
+
+        assert response.status_code == 200
+        assert updates == []
+    finally:
+        event.remove(engine, "before_cursor_execute", executed)
+
+
+async def test_reconcile_menus(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menus = [Menu(title=f"Menu {n}", description="") for n in range(2)]
+    async_session.add_all(menus)
+    await async_session.commit()
+    await async_session.execute(update(Menu).values(submenus_count=5))
+    await async_session.commit()
+
+    # Menus out of scope are left drifted
+    assert await reconcile(async_session, [menus[0].id]) == {
+        "menus": 1, "submenus": 0,
+    }
+    assert await reconcile(async_session, []) == {"menus": 0, "submenus": 0}
+    assert await reconcile(async_session) == {"menus": 1, "submenus": 0}
@@ -1,5 +1,6 @@
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from menu_app.models.dish_model import Dish
@@ -219,3 +220,81 @@ async def test_count_dishes(
 
     assert response.status_code == 200
     assert data["dishes_count"] == 0
+
+
+async def test_counts_in_menu_list(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu_1 = Menu(title="Menu 1", description="Menu description 1")
+    menu_2 = Menu(title="Menu 2", description="Menu description 2")
+    async_session.add(menu_1)
+    async_session.add(menu_2)
+    await async_session.commit()
+
+    submenu_1 = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu_1.id
+    )
+    submenu_2 = Submenu(
+            title="Submenu 2",
+            description="Submenu description 2",
+            menu_id=menu_1.id
+    )
+    async_session.add(submenu_1)
+    async_session.add(submenu_2)
+    await async_session.commit()
+
+    for submenu in (submenu_1, submenu_1, submenu_2):
+        async_session.add(Dish(
+            title="Dish",
+            description="Dish description",
+            price=1.5,
+            submenu_id=submenu.id,
+        ))
+    await async_session.commit()
+
+    response = await async_client.get("menus")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data[0]["id"] == str(menu_1.id)
+    assert data[0]["submenus_count"] == 2
+    assert data[0]["dishes_count"] == 3
+    assert data[1]["id"] == str(menu_2.id)
+    assert data[1]["submenus_count"] == 0
+    assert data[1]["dishes_count"] == 0
+
+
+async def test_read_counts_does_not_write(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+
+    statements = list()
+
+    def log_statement(conn, cursor, statement, *args):
+        statements.append(statement.split()[0].upper())
+
+    engine = async_session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", log_statement)
+    try:
+        await async_client.get("menus")
+        await async_client.get(f"menus/{menu.id}")
+        await async_client.get(f"menus/{menu.id}/submenus/{submenu.id}")
+    finally:
+        event.remove(engine, "before_cursor_execute", log_statement)
+
+    assert statements
+    assert set(statements) == {"SELECT"}
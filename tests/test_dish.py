@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -228,3 +230,131 @@ async def test_delete_dish(
 
     assert response.status_code == 200
     assert dish_in_db is None
+
+
+async def test_read_dishes_pages(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+    for number in range(5):
+        async_session.add(Dish(
+                title=f"Dish {number}",
+                description="Dish description",
+                price=9.99,
+                submenu_id=submenu.id,
+        ))
+    await async_session.commit()
+    url = f"menus/{menu.id}/submenus/{submenu.id}/dishes"
+
+    titles = list()
+    cursor = None
+    while True:
+        params = {"limit": 2, "after": cursor} if cursor else {"limit": 2}
+        data = (await async_client.get(url, params=params)).json()
+        titles += [dish["title"] for dish in data["items"]]
+        cursor = data["next"]
+        if cursor is None:
+            break
+
+    assert titles == [f"Dish {number}" for number in range(5)]
+
+    # Pages are cleared together with the list
+    dish_id = (await async_client.get(url, params={"limit": 1})).json()[
+        "items"
+    ][0]["id"]
+    await async_client.delete(f"{url}/{dish_id}")
+    data = (await async_client.get(url, params={"limit": 1})).json()
+
+    assert data["items"][0]["title"] == "Dish 1"
+
+    response = await async_client.get(url, params={"after": "*", "limit": 1})
+
+    assert response.status_code == 400
+
+
+async def test_create_dishes_bulk(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+    await async_client.get(f"menus/{menu.id}")
+
+    response = await async_client.post(
+            f"menus/{menu.id}/submenus/{submenu.id}/dishes/bulk",
+            json=[
+                {
+                    "title": f"Dish {number}",
+                    "description": "Dish description",
+                    "price": 9.99,
+                }
+                for number in range(3)
+            ],
+    )
+    data = response.json()
+
+    assert response.status_code == 201
+    assert [dish["title"] for dish in data] == ["Dish 0", "Dish 1", "Dish 2"]
+    assert data[0]["price"] == "9.99"
+
+    response = await async_client.get(f"menus/{menu.id}")
+
+    assert response.json()["dishes_count"] == 3
+
+    response = await async_client.get(
+            f"menus/{menu.id}/submenus/{submenu.id}/dishes"
+    )
+
+    assert len(response.json()) == 3
+
+
+async def test_read_dishes_ndjson(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+    for number in range(3):
+        async_session.add(Dish(
+                title=f"Dish {number}",
+                description="Dish description",
+                price=9.99,
+                submenu_id=submenu.id,
+        ))
+    await async_session.commit()
+    url = f"menus/{menu.id}/submenus/{submenu.id}/dishes"
+
+    response = await async_client.get(
+            url, headers={"Accept": "application/x-ndjson"}
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert lines == (await async_client.get(url)).json()
@@ -128,3 +128,28 @@ async def test_delete_menu(
 
     assert response.status_code == 200
     assert menu_in_db is None
+
+
+@pytest.mark.parametrize("accept, content_type", [
+    ("application/x-ndjson", "application/x-ndjson"),
+    ("application/x-ndjson, */*;q=0.1", "application/x-ndjson"),
+    ("Application/X-NDJSON ; charset=utf-8", "application/x-ndjson"),
+    ("application/json;q=0.5, application/x-ndjson", "application/x-ndjson"),
+    ("application/json, application/x-ndjson;q=0.9", "application/json"),
+    ("application/x-ndjson;q=0, */*", "application/json"),
+    ("application/x-ndjson, application/json", "application/json"),
+    ("*/*", "application/json"),
+])
+async def test_read_menus_accept(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+        accept: str,
+        content_type: str,
+):
+    async_session.add(Menu(title="Menu 1", description="Menu description 1"))
+    await async_session.commit()
+
+    response = await async_client.get("menus", headers={"Accept": accept})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == content_type
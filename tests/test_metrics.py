@@ -0,0 +1,78 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from menu_app.models.menu_model import Menu
+
+
+pytestmark = pytest.mark.asyncio
+
+
+def sample(metrics: str, line: str) -> float:
+    for metric in metrics.splitlines():
+        if metric.startswith(line + " "):
+            return float(metric.rsplit(" ", 1)[1])
+    return 0
+
+
+async def test_metrics(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    url = async_client.base_url.copy_with(path="/metrics")
+    before = (await async_client.get(url)).text
+
+    await async_client.get(f"menus/{menu.id}")
+    await async_client.get(f"menus/{menu.id}")
+    await async_client.get("menus/0")
+    response = await async_client.get(url)
+    after = response.text
+
+    assert response.status_code == 200
+    for line, change in (
+            (
+                'http_requests_total{method="GET",'
+                'route="/api/v1/menus/{menu_id}",status="200"}',
+                2,
+            ),
+            (
+                'http_requests_total{method="GET",'
+                'route="/api/v1/menus/{menu_id}",status="404"}',
+                1,
+            ),
+            ('cache_requests_total{prefix="menu",result="hit"}', 1),
+            ('cache_requests_total{prefix="menu",result="miss"}', 2),
+            ('sql_queries_total{method="MenuCrud.get"}', 2),
+    ):
+        assert sample(after, line) - sample(before, line) == change, line
+    assert "db_pool_checkouts" in after
+
+
+async def test_streamed_and_failed_requests(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    url = async_client.base_url.copy_with(path="/metrics")
+    line = (
+        'http_requests_total{method="GET",route="/api/v1/export",'
+        'status="200"}'
+    )
+    before = sample((await async_client.get(url)).text, line)
+
+    response = await async_client.get("export")
+
+    assert response.status_code == 200
+    assert sample((await async_client.get(url)).text, line) == before + 1
+
+    # Start times of failed statements do not pile up on the connection
+    connection = await async_session.connection()
+    with pytest.raises(OperationalError):
+        await connection.execute(text("SELECT * FROM missing"))
+    raw = await connection.get_raw_connection()
+
+    assert raw.info.get("query_started") == []
@@ -177,3 +177,30 @@ async def test_delete_submenu(
 
     assert response.status_code == 200
     assert submenu_in_db is None
+
+
+async def test_create_submenus_bulk(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    await async_client.get("menus")
+
+    response = await async_client.post(
+            f"menus/{menu.id}/submenus/bulk",
+            json=[
+                {"title": "Submenu 1", "description": "Submenu 1"},
+                {"title": "Submenu 2", "description": "Submenu 2"},
+            ],
+    )
+
+    assert response.status_code == 201
+    assert [submenu["menu_id"] for submenu in response.json()] == [
+        menu.id, menu.id,
+    ]
+
+    response = await async_client.get("menus")
+
+    assert response.json()[0]["submenus_count"] == 2
@@ -0,0 +1,211 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import delete
+
+from menu_app import transfer
+from menu_app.models.dish_model import Dish
+from menu_app.models.menu_model import Menu
+from menu_app.models.submenu_model import Submenu
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def fill(async_session: AsyncSession) -> Menu:
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu, 1",
+            description="Submenu \"description\"\n1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+    for number in range(3):
+        async_session.add(Dish(
+                title=f"Dish {number}",
+                description="Dish description",
+                price=9.99,
+                submenu_id=submenu.id,
+        ))
+    await async_session.commit()
+
+    return menu
+
+
+async def empty(async_session: AsyncSession):
+    for model in (Dish, Submenu, Menu):
+        await async_session.execute(delete(model))
+    await async_session.commit()
+
+
+@pytest.mark.parametrize("format, content_type", [
+    ("jsonl", "application/x-ndjson"),
+    ("csv", "text/csv"),
+])
+async def test_export_import(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+        format: str,
+        content_type: str,
+):
+    menu = await fill(async_session)
+    tree = (await async_client.get("menus/tree")).json()
+
+    response = await async_client.get("export", params={"format": format})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(content_type)
+
+    await empty(async_session)
+    response = await async_client.post(
+            "import",
+            content=response.content,
+            headers={"Content-Type": content_type},
+    )
+
+    assert response.status_code == 201
+    assert response.json() == {"menu": 1, "submenu": 1, "dish": 3}
+
+    response = await async_client.get(f"menus/{menu.id}")
+
+    assert response.json()["dishes_count"] == 3
+    assert (await async_client.get("menus/tree")).json() == tree
+
+
+async def test_import_invalid_record(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    response = await async_client.post(
+            "import",
+            content=(
+                b'{"type": "menu", "id": 1, "title": "Menu 1", '
+                b'"description": "Menu description 1"}\n'
+                b'{"type": "menu", "id": 2}\n'
+            ),
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == "invalid record 2"
+
+    response = await async_client.get("menus")
+
+    assert response.json() == []
+
+
+async def test_import_csv_in_chunks(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    body = (
+        'type,id,title,description\n'
+        'menu,1,Menu 1,"Menu, first line\nsecond — line"\n'
+        'menu,2,Menu 2,"unterminated\n'
+    ).encode()
+
+    async def chunks(body: bytes):
+
+        # Splits a multi-byte character and the quoted line end
+        for start in range(0, len(body), 3):
+            yield body[start:start + 3]
+
+    response = await async_client.post(
+            "import",
+            content=chunks(body),
+            headers={"Content-Type": "text/csv"},
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == "invalid record 2"
+
+    response = await async_client.post(
+            "import",
+            content=chunks(body[:body.index(b"menu,2")]),
+            headers={"Content-Type": "text/csv"},
+    )
+
+    assert response.status_code == 201
+
+    response = await async_client.get("menus/1")
+
+    assert response.json()["description"] == (
+        "Menu, first line\nsecond — line"
+    )
+
+
+@pytest.mark.parametrize("line", [
+    b'[1]',
+    b'"menu"',
+    b'{"type": "menu", "id": null, "title": "Menu", "description": ""}',
+])
+async def test_import_not_a_record(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+        line: bytes,
+):
+    response = await async_client.post("import", content=line)
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == "invalid record 1"
+
+
+async def test_import_conflicts(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = (
+        b'{"type": "menu", "id": 1, "title": "Menu 1", '
+        b'"description": "Menu description 1"}\n'
+    )
+
+    response = await async_client.post("import", content=menu + menu)
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "record 2: menu 1 already exists"
+    assert (await async_client.get("menus")).json() == []
+
+    response = await async_client.post("import", content=menu)
+
+    assert response.status_code == 201
+
+    response = await async_client.post("import", content=menu)
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "record 1: menu 1 already exists"
+
+
+@pytest.mark.parametrize("last, status_code", [
+    (b'{"type": "menu", "id": 4}\n', 422),
+    (
+        b'{"type": "menu", "id": 1, "title": "Menu 1", '
+        b'"description": ""}\n',
+        409,
+    ),
+])
+async def test_failed_import_leaves_no_rows(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+        monkeypatch: pytest.MonkeyPatch,
+        last: bytes,
+        status_code: int,
+):
+
+    # The first chunk is written before the second one fails: COPY on
+    # Postgres, an executemany elsewhere
+    monkeypatch.setattr(transfer, "CHUNK_SIZE", 2)
+    body = b"".join(
+        b'{"type": "menu", "id": %d, "title": "Menu %d", '
+        b'"description": ""}\n' % (id, id)
+        for id in range(1, 4)
+    )
+
+    response = await async_client.post("import", content=body + last)
+
+    assert response.status_code == status_code
+
+    response = await async_client.get("menus")
+
+    assert response.json() == []
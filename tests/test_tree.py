@@ -0,0 +1,97 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from menu_app.models.dish_model import Dish
+from menu_app.models.menu_model import Menu
+from menu_app.models.submenu_model import Submenu
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_read_tree(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    async_session.add(Menu(title="Menu 2", description="Menu description 2"))
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+    async_session.add(Dish(
+            title="Dish 1",
+            description="Dish description 1",
+            price=99.99,
+            submenu_id=submenu.id,
+    ))
+    await async_session.commit()
+
+    response = await async_client.get("menus/tree")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [menu["title"] for menu in data] == ["Menu 1", "Menu 2"]
+    assert data[0]["submenus_count"] == 1
+    assert data[0]["dishes_count"] == 1
+    assert data[0]["submenus"][0]["dishes"][0]["price"] == "99.99"
+    assert data[1]["submenus"] == []
+
+    response = await async_client.get(f"menus/{menu.id}/tree")
+
+    assert response.json() == data[0]
+
+    response = await async_client.get("menus/0/tree")
+
+    assert response.status_code == 404
+
+
+async def test_tree_follows_writes(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+    await async_client.get("menus/tree")
+    await async_client.get(f"menus/{menu.id}/tree")
+
+    response = await async_client.post(
+            f"menus/{menu.id}/submenus/{submenu.id}/dishes",
+            json={
+                "title": "Dish 1",
+                "description": "Dish description 1",
+                "price": 99.99,
+            },
+    )
+    dish_id = response.json()["id"]
+    await async_client.patch(
+            f"menus/{menu.id}/submenus/{submenu.id}/dishes/{dish_id}",
+            json={"price": "19.99"},
+    )
+
+    for url in ("menus/tree", f"menus/{menu.id}/tree"):
+        response = await async_client.get(url)
+        data = response.json()
+        menu_data = data[0] if isinstance(data, list) else data
+
+        assert menu_data["dishes_count"] == 1
+        assert menu_data["submenus"][0]["dishes"][0]["price"] == "19.99"
+
+    await async_client.delete(f"menus/{menu.id}/submenus/{submenu.id}")
+    response = await async_client.get("menus/tree")
+
+    assert response.json()[0]["submenus"] == []
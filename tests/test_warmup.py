@@ -0,0 +1,84 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from menu_app import warmup
+from menu_app.cache import Cache
+from menu_app.models.menu_model import Menu
+from menu_app.models.submenu_model import Submenu
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_warm(
+        async_session: AsyncSession,
+        async_client: AsyncClient,
+):
+    menu = Menu(title="Menu 1", description="Menu description 1")
+    async_session.add(menu)
+    await async_session.commit()
+    submenu = Submenu(
+            title="Submenu 1",
+            description="Submenu description 1",
+            menu_id=menu.id
+    )
+    async_session.add(submenu)
+    await async_session.commit()
+
+    state = await warmup.warm(concurrency=2)
+
+    assert state["status"] == "ready"
+    assert state["done"] == state["total"] == 5
+    for key in (
+            "menus",
+            f"menu:{menu.id}",
+            f"menu:{menu.id}/submenus",
+            f"menu:{menu.id}/submenu:{submenu.id}",
+            f"menu:{menu.id}/submenu:{submenu.id}/dishes",
+    ):
+        assert await Cache.get_data(key) is not None, key
+
+    data = await Cache.get_data(f"menu:{menu.id}")
+
+    assert data["submenus_count"] == 1
+
+    response = await async_client.get("ready")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+
+async def test_ready_while_warming(async_client: AsyncClient):
+    warmup.state["status"] = "warming"
+    try:
+        response = await async_client.get("ready")
+    finally:
+        warmup.state["status"] = "idle"
+
+    assert response.status_code == 503
+    assert response.json()["status"] == "warming"
+
+
+async def test_failed_warm_up(
+        async_client: AsyncClient,
+        monkeypatch: pytest.MonkeyPatch,
+):
+    async def jobs():
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(warmup, "jobs", jobs)
+    task = warmup.start()
+
+    with pytest.raises(RuntimeError):
+        await task
+
+    assert task not in warmup.tasks
+    try:
+        response = await async_client.get("ready")
+    finally:
+        warmup.state["status"] = "idle"
+
+    assert response.status_code == 503
+    assert response.json()["status"] == "failed"
+    assert response.json()["error"] == "database is gone"